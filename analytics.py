@@ -0,0 +1,83 @@
+from calendar import isleap
+from datetime import date
+
+import numpy as np
+
+# datetime64[D] counts days from 1970-01-01, date.toordinal() from 0001-01-01
+EPOCH = date(1970, 1, 1).toordinal()
+NAT = np.iinfo(np.int64).min
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+
+class BookColumns:
+    # the book as one array per field, a row per contact; the reports below
+    # are whole-array operations instead of a loop over the records
+    def __init__(self, names, birthdays, phones, notes, tags):
+        names = np.array(names, dtype=object)
+        size = len(names)
+        # rows are kept in name order, so a stable sort by anything else
+        # leaves ties sorted by name
+        order = np.argsort(names, kind="stable")
+        self.names = names[order]
+        # going through ordinals is far quicker than numpy parsing date objects
+        ordinals = np.fromiter((born.toordinal() if born else 0 for born in birthdays), np.int64, size)[order]
+        self.birthdays = np.where(ordinals > 0, ordinals - EPOCH, NAT).astype("datetime64[D]")
+        # month and day (both from 0, -1 without a birthday) once here, the
+        # datetime64 unit conversions are the slow part of every report
+        known = ordinals > 0
+        months = self.birthdays[known].astype("datetime64[M]")
+        self.months = np.full(size, -1, dtype=np.int8)
+        self.months[known] = months.astype(np.int64) % 12
+        self.days = np.full(size, -1, dtype=np.int8)
+        self.days[known] = (self.birthdays[known] - months.astype("datetime64[D]")).astype(np.int64)
+        self.phones = np.fromiter(phones, np.int32, size)[order]
+        self.notes = np.fromiter(notes, np.int32, size)[order]
+        self.tags = tags
+        self._days_of_year = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def birthdays_by_month(self):
+        return np.bincount(self.months[self.months >= 0], minlength=12)
+
+    def without_phones(self):
+        return self.names[self.phones == 0]
+
+    def notes_by_tag(self, limit=None):
+        return sorted(self.tags.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def notes_by_contact(self, limit=10):
+        # the contacts with the most notes, biggest first
+        limit = min(limit, len(self))
+        if not limit:
+            return []
+        top = np.argpartition(-self.notes, limit - 1)[:limit]
+        top = top[self.notes[top] > 0]
+        return sorted(zip(self.names[top], self.notes[top].tolist()), key=lambda item: (-item[1], item[0]))
+
+    def _day_of_year(self, leap):
+        # from 0 for every contact; Feb 29 birthdays are celebrated on Feb 28
+        # in non-leap years. Only leap or not matters, so there are two.
+        # Rows without a birthday get junk here and are masked by the caller
+        found = self._days_of_year.get(leap)
+        if found is None:
+            lengths = MONTH_DAYS + (np.arange(12) == 1) * leap
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            found = (starts[self.months] + np.minimum(self.days, lengths[self.months] - 1)).astype(np.int32)
+            self._days_of_year[leap] = found
+        return found
+
+    def days_to_birthdays(self, today):
+        # days until every contact's next birthday, -1 for an unknown one
+        today_index = today.timetuple().tm_yday - 1
+        left = self._day_of_year(isleap(today.year)) - today_index
+        next_year = self._day_of_year(isleap(today.year + 1)) + (365 + isleap(today.year) - today_index)
+        return np.where(self.months < 0, -1, np.where(left >= 0, left, next_year))
+
+    def upcoming(self, days, today):
+        # (days left, name) for the birthdays in the next `days` days
+        left = self.days_to_birthdays(today)
+        found = np.flatnonzero((left >= 0) & (left <= days))
+        found = found[np.argsort(left[found], kind="stable")]
+        return list(zip(left[found].tolist(), self.names[found].tolist()))
@@ -0,0 +1,578 @@
+import argparse
+import asyncio
+from contextlib import redirect_stdout
+import csv
+import gc
+from datetime import date, datetime
+import io
+from itertools import islice
+import json
+import os
+import platform
+import pickle
+import random
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from exchange import read_rows, write_rows
+from indexes import FuzzyIndex, NameIndex
+from main import AddressBook, Controller, NoteRecord, Phone, command_completer, record_from_row
+from server import BookServer
+
+FIRST_NAMES = ["Oleksandr", "Olena", "Andrii", "Iryna", "Taras", "Mariia", "Dmytro", "Kateryna", "Serhii", "Natalia"]
+LAST_NAMES = ["Shevchenko", "Kovalenko", "Bondarenko", "Tkachenko", "Kravchenko", "Melnyk", "Boiko", "Koval"]
+
+
+def unique_suffix(number):
+    letters = []
+    while True:
+        number, rest = divmod(number, 26)
+        letters.append(string.ascii_lowercase[rest])
+        if not number:
+            return "".join(reversed(letters)).title()
+
+
+def make_book(size, seed=0, file="bench_book.pkl"):
+    rnd = random.Random(seed)
+    book = AddressBook(file)
+    for i in range(size):
+        name = f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {unique_suffix(i)}"
+        record = NoteRecord(name)
+        for _ in range(rnd.randint(1, 2)):
+            record.add_phone("".join(rnd.choice(string.digits) for _ in range(10)))
+        book.add_record(record)
+    book.journal.pending.clear()
+    return book
+
+
+class DictField:
+    # the pre-__slots__ layout: one __dict__ per field, phones as strings
+    def __init__(self, value):
+        self._value = value
+
+
+class DictRecord:
+    def __init__(self, name):
+        self.name = DictField(name)
+        self.phones = []
+        self.email = None
+        self.address = None
+        self.birthday = None
+        self.notes = []
+
+
+def make_contacts(cls, phone_cls, size, seed=0):
+    rnd = random.Random(seed)
+    contacts = []
+    for i in range(size):
+        record = cls(f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {unique_suffix(i)}")
+        for _ in range(2):
+            record.phones.append(phone_cls("".join(rnd.choice(string.digits) for _ in range(10))))
+        contacts.append(record)
+    return contacts
+
+
+def bench_memory(size=100_000):
+    for label, cls, phone_cls in (("dict", DictRecord, DictField), ("slots", NoteRecord, Phone)):
+        tracemalloc.start()
+        contacts = make_contacts(cls, phone_cls, size)
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pickled = len(pickle.dumps(contacts))
+        print(f"{label:>5}: {used / size:.0f} bytes/contact in memory, {pickled / size:.0f} bytes/contact pickled")
+
+
+def linear_find_by_term(book, term):
+    matching_records = []
+    for record in book.data.values():
+        for phone in record.phones:
+            if term in phone.value:
+                matching_records.append(record)
+    matching_records.extend(record for record in book.data.values() if term.lower() in record.name.value.lower())
+    return matching_records
+
+
+def timed(func, terms):
+    start = time.perf_counter()
+    for term in terms:
+        func(term)
+    return (time.perf_counter() - start) / len(terms)
+
+
+def bench_find_by_term(size=100_000, queries=50):
+    book = make_book(size)
+    rnd = random.Random(1)
+    records = list(book)
+    terms = []
+    for _ in range(queries):
+        record = rnd.choice(records)
+        phone = record.phones[0].value
+        start = rnd.randint(0, 5)
+        terms.append(phone[start:start + 5])
+        terms.append(record.name.value.split()[-1].lower())
+    linear = timed(lambda term: linear_find_by_term(book, term), terms)
+    indexed = timed(book.find_by_term, terms)
+    print(f"find_by_term, {size} records: linear {linear * 1000:.3f} ms, "
+          f"index {indexed * 1000:.3f} ms, x{linear / indexed:.0f}")
+
+
+def bench_import(size=100_000):
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "contacts.csv")
+        with open(source, "w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(["name", "phones", "email", "address", "birthday", "notes"])
+            for i in range(size):
+                phones = ";".join("".join(rnd.choice(string.digits) for _ in range(10)) for _ in range(2))
+                writer.writerow([f"{rnd.choice(FIRST_NAMES)} {unique_suffix(i)}", phones,
+                                 f"user{i}@mail.com", "Kyiv", "1990-01-31", ""])
+        book = AddressBook(os.path.join(tmp, "book.pkl"))
+        start = time.perf_counter()
+        added, merged, rejected = book.import_rows(read_rows(source))
+        imported = time.perf_counter() - start
+        start = time.perf_counter()
+        count = write_rows(os.path.join(tmp, "export.jsonl"), book.export_rows())
+        exported = time.perf_counter() - start
+    print(f"import: {size / imported:.0f} rows/s ({added} added, {rejected} rejected), "
+          f"export: {count / exported:.0f} rows/s")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def load_server(clients, requests):
+    with tempfile.TemporaryDirectory() as tmp:
+        controller = Controller(AddressBook(os.path.join(tmp, "book.pkl")))
+        controller.start_autosave(1.0)
+        server = BookServer(controller)
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        latencies = []
+
+        async def client(number):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+            async def call(command, answers=()):
+                start = time.perf_counter()
+                writer.write((json.dumps({"command": command, "input": list(answers)}) + "\n").encode())
+                await writer.drain()
+                await reader.readline()
+                latencies.append(time.perf_counter() - start)
+
+            name = f"Client {unique_suffix(number)}"
+            await call("add_name", [name])
+            for i in range(requests):
+                if i % 4 == 0:
+                    await call(f"add_phone {name.split()[1]} {number * requests + i:010d}")
+                else:
+                    await call(f"find_info {number:05d}")
+            writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(number) for number in range(clients)))
+        elapsed = time.perf_counter() - start
+        listener.close()
+        controller.do_exit()
+    print(f"server, {clients} clients: {len(latencies) / elapsed:.0f} requests/s, "
+          f"p50 {percentile(latencies, 0.5) * 1000:.2f} ms, p99 {percentile(latencies, 0.99) * 1000:.2f} ms",
+          file=sys.stderr)
+
+
+def bench_server(clients=50, requests=200):
+    asyncio.run(load_server(clients, requests))
+
+
+NOTE_WORDS = ["call", "meeting", "birthday", "gift", "project", "deadline", "dinner", "trip", "invoice", "review"]
+
+
+def synthetic_rows(size, seed=0):
+    rnd = random.Random(seed)
+    for i in range(size):
+        notes = []
+        for _ in range(rnd.randint(0, 3)):
+            words = rnd.sample(NOTE_WORDS, 4)
+            notes.append({"text": " ".join(words), "tags": words[:2], "date": f"2024-{rnd.randint(1, 12):02d}-01 12:00:00"})
+        yield {
+            "name": f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)} {unique_suffix(i)}",
+            "phones": ["".join(rnd.choice(string.digits) for _ in range(10)) for _ in range(rnd.randint(1, 2))],
+            "email": f"user{i}@mail.com",
+            "address": "Kyiv",
+            "birthday": date(1950 + rnd.randrange(60), rnd.randint(1, 12), rnd.randint(1, 28)).isoformat(),
+            "notes": notes,
+        }
+
+
+def measure(func, args, memory_sample=10):
+    latencies = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        latencies.append(time.perf_counter() - start)
+    # tracemalloc slows every allocation down, so peak memory comes from a
+    # separate, shorter run
+    tracemalloc.start()
+    for arg in args[:memory_sample]:
+        func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ops": len(latencies),
+        "ops_per_s": len(latencies) / sum(latencies),
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+def render_page(book, page):
+    with redirect_stdout(io.StringIO()):
+        Controller(book).do_list_book(f"--page {page}")
+
+
+def run_suite(size, queries=200, seed=0):
+    rnd = random.Random(seed)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        file = os.path.join(tmp, "book.pkl")
+        book = AddressBook(file)
+        start = time.perf_counter()
+        book.import_rows(synthetic_rows(size, seed))
+        results["build"] = {"ops": size, "ops_per_s": size / (time.perf_counter() - start)}
+        results["dump"] = measure(lambda _: book.compact(), [None] * 3, 1)
+        results["pickle"] = {
+            "snapshot_bytes": os.path.getsize(file),
+            "pickle_bytes": len(pickle.dumps((book.record_id, dict(book.data.items())))),
+        }
+
+        def load(_):
+            loaded = AddressBook(file)
+            loaded.load()
+            loaded.find_by_term("0")
+        results["load"] = measure(load, [None] * 3, 1)
+
+        book = AddressBook(file)
+        book.load()
+        records = [book.data[name] for name in rnd.sample(list(book.data), min(size, queries))]
+        terms = []
+        for record in records:
+            phone = record.phones[0].value
+            start = rnd.randint(0, 5)
+            terms += [phone[start:start + 5], record.name.value.split()[-1].lower()]
+        results["find_by_term"] = measure(book.find_by_term, terms)
+        results["find_by_phone"] = measure(book.find_by_phone, [record.phones[0].value for record in records])
+        results["days_to_birthday"] = measure(book.days_to_birthday, [record.name.value for record in records])
+        pages = max(1, size // 50)
+        results["list_book"] = measure(lambda page: render_page(book, page), [rnd.randint(1, pages) for _ in range(20)], 3)
+    return results
+
+
+def print_results(size, results):
+    for name, stats in results.items():
+        if "p50_ms" in stats:
+            print(f"{size:>8} {name:<17}{stats['ops_per_s']:>12.1f} ops/s   p50 {stats['p50_ms']:8.3f}  "
+                  f"p95 {stats['p95_ms']:8.3f}  p99 {stats['p99_ms']:8.3f} ms   peak {stats['peak_kb']:9.0f} KiB")
+        elif "ops_per_s" in stats:
+            print(f"{size:>8} {name:<17}{stats['ops_per_s']:>12.1f} ops/s")
+        else:
+            print(f"{size:>8} {name:<17}{stats['snapshot_bytes'] / size:>12.0f} bytes/contact snapshot, "
+                  f"{stats['pickle_bytes'] / size:.0f} bytes/contact pickle")
+
+
+def compare(report, baseline, tolerance):
+    # p50 is compared: tails are too noisy on a shared machine
+    regressions = []
+    for size, benchmarks in report["sizes"].items():
+        for name, stats in benchmarks.items():
+            old = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not old or "p50_ms" not in stats or "p50_ms" not in old:
+                continue
+            change = stats["p50_ms"] / old["p50_ms"] - 1
+            mark = " <-- повільніше" if change > tolerance else ""
+            print(f"{size:>8} {name:<17}p50 {old['p50_ms']:8.3f} -> {stats['p50_ms']:8.3f} ms ({change:+.0%}){mark}")
+            if mark:
+                regressions.append((size, name))
+    return regressions
+
+
+def bench_suite(sizes=(1000, 100_000), save=None, baseline=None, tolerance=0.2):
+    report = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": {},
+    }
+    for size in sizes:
+        results = run_suite(size)
+        report["sizes"][str(size)] = results
+        print_results(size, results)
+    if save:
+        with open(save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if baseline:
+        with open(baseline, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), tolerance)
+        if regressions:
+            print(f"Регресії: {len(regressions)}")
+            return 1
+    return 0
+
+
+def bench_completion(size=1_000_000, queries=2000):
+    from prompt_toolkit.document import Document
+    rnd = random.Random(0)
+    names = [f"{rnd.choice(FIRST_NAMES)}{rnd.choice(LAST_NAMES)}{unique_suffix(i)}" for i in range(size)]
+    book = AddressBook(os.devnull)
+    start = time.perf_counter()
+    # only the name index matters here, so it is filled in directly
+    book.names = NameIndex(names)
+    built = time.perf_counter() - start
+    completer = command_completer(book)
+    lines = [f"add_phone {rnd.choice(names)[:rnd.randint(1, 12)]}" for _ in range(queries)]
+    stats = measure(lambda line: list(completer.get_completions(Document(line), None)), lines)
+    print(f"completion, {size} names: index built in {built:.2f} s, "
+          f"p50 {stats['p50_ms']:.3f} ms, p99 {stats['p99_ms']:.3f} ms")
+
+
+SYLLABLES = ["ka", "lo", "mi", "ser", "han", "dro", "vyk", "ol", "na", "ta", "ri", "ko", "zen", "bor", "sla",
+             "ma", "ly", "chuk", "enko", "iv"]
+
+
+def bench_fuzzy(size=1_000_000, queries=300):
+    # made-up first and last names from syllables: a realistic number of
+    # distinct name parts, unlike the unique suffixes of make_book
+    rnd = random.Random(0)
+    word = lambda parts: "".join(rnd.choice(SYLLABLES) for _ in range(parts)).title()
+    firsts = [word(rnd.randint(2, 3)) for _ in range(3000)]
+    lasts = [word(rnd.randint(2, 4)) for _ in range(50_000)]
+    names = list({f"{rnd.choice(firsts)} {rnd.choice(lasts)}" for _ in range(size)})
+    index = FuzzyIndex()
+    start = time.perf_counter()
+    for name in names:
+        index.set(name, name)
+    built = time.perf_counter() - start
+    typos = []
+    for _ in range(queries):
+        name = list(rnd.choice(names))
+        i = rnd.randrange(len(name))
+        if name[i] != " ":
+            name[i] = rnd.choice(string.ascii_lowercase)
+        typos.append("".join(name))
+    stats = measure(index.search, typos)
+    print(f"fuzzy, {len(names)} names: index built in {built:.1f} s, "
+          f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+
+
+def per_record_report(book, days):
+    # what the analytics command replaces: one pass over the records
+    months = [0] * 12
+    missing = 0
+    tags = {}
+    upcoming = []
+    for record in book:
+        if record.birthday:
+            months[record.birthday.date.month - 1] += 1
+        if not record.phones:
+            missing += 1
+        for note in record.notes:
+            for tag in note.tags:
+                tags[tag] = tags.get(tag, 0) + 1
+        days_left = record.days_to_birthday()
+        if 0 <= days_left <= days:
+            upcoming.append((days_left, record.name.value))
+    return months, missing, tags, sorted(upcoming)
+
+
+def columnar_report(columns, days):
+    return (columns.birthdays_by_month().tolist(), len(columns.without_phones()), columns.tags,
+            columns.upcoming(days, date.today()))
+
+
+def bench_analytics(size=1_000_000, days=30):
+    book = AddressBook(os.devnull)
+    # add_record would keep all the indexes and a journal entry per contact;
+    # only the records and the indexes the report reads are filled in here.
+    # Millions of live objects also make every full collection slower, so gc
+    # is off for the set-up and both reports are timed with it back on
+    gc.disable()
+    for row in synthetic_rows(size):
+        record = record_from_row(row)
+        name = record.name.value
+        book.data[name] = record
+        book.birthdays.set(name, record.birthday.date if record.birthday else None)
+        book.phones.set(name, [phone.value for phone in record.phones])
+        book.tags.set_notes(name, record.notes)
+    gc.enable()
+    gc.freeze()
+    start = time.perf_counter()
+    expected = per_record_report(book, days)
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    columns = book.analytics()
+    built = time.perf_counter() - start
+    stats = measure(lambda _: columnar_report(book.analytics(), days), range(20), memory_sample=2)
+    assert columnar_report(columns, days) == expected
+    print(f"analytics, {size} contacts: per-record {loop * 1000:.0f} ms, columns built in {built * 1000:.0f} ms, "
+          f"cached report p50 {stats['p50_ms']:.1f} ms ({loop * 1000 / stats['p50_ms']:.0f}x)")
+
+
+def bench_compaction(size=100_000):
+    # how long writers wait while the book is compacted next to them
+    with tempfile.TemporaryDirectory() as tmp:
+        book = AddressBook(os.path.join(tmp, "book.pkl"))
+        book.import_rows(synthetic_rows(size))
+        names = list(islice(book.data, 1000))
+        for name in names:
+            book[name].add_phone("0501234567")
+        stop = threading.Event()
+        latencies = []
+
+        def write():
+            rnd = random.Random(0)
+            while not stop.is_set():
+                start = time.perf_counter()
+                book[rnd.choice(names)].add_note("bench", "bench")
+                latencies.append(time.perf_counter() - start)
+                time.sleep(0.001)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        start = time.perf_counter()
+        book.compact()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        writer.join()
+    latencies.sort()
+    print(f"compaction, {size} contacts: {elapsed * 1000:.0f} ms, {len(latencies)} writes meanwhile, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, max {latencies[-1] * 1000:.0f} ms")
+
+
+def misspell(name, rnd):
+    # the kinds of copies the book collects: a typo, swapped words, Cyrillic
+    words = name.split()
+    kind = rnd.randrange(3)
+    if kind == 0:
+        i = rnd.randrange(1, len(words[1]) - 1)
+        words[1] = words[1][:i] + words[1][i + 1] + words[1][i] + words[1][i + 2:]
+    elif kind == 1:
+        words[0], words[1] = words[1], words[0]
+    else:
+        words[1] = words[1].translate(str.maketrans("abdeiklmnorstvyz", "абдеіклмнорствиз"))
+    return " ".join(words)
+
+
+def bench_dedupe(size=1_000_000, share=0.05):
+    # a planted near-duplicate for every 1/share-th contact, sharing its phone,
+    # its email or nothing but the name. A typo with nothing else in common is
+    # left alone on purpose, so the last kind is only partly found
+    from dedupe import Duplicates, contact_from_row, folded, score
+
+    rnd = random.Random(1)
+    rows = list(synthetic_rows(size))
+    planted = {}
+    for i in range(0, size, int(1 / share)):
+        row = rows[i]
+        shared = rnd.choice(("phone", "email", "name"))
+        rows.append({"name": misspell(row["name"], rnd), "notes": [], "address": "", "birthday": "",
+                     "phones": row["phones"][:1] if shared == "phone" else [],
+                     "email": row["email"] if shared == "email" else ""})
+        planted[i, len(rows) - 1] = shared
+    contacts = [contact_from_row(row) for row in rows]
+    del rows
+    start = time.perf_counter()
+    found = Duplicates(contacts)
+    elapsed = time.perf_counter() - start
+    pairs = {(keep, i) if keep < i else (i, keep) for keep, others in found.groups for i, _ in others}
+    # comparing every pair instead, from the cost of a sample
+    sample = [(rnd.randrange(len(contacts)), rnd.randrange(len(contacts))) for _ in range(20_000)]
+    names = {i: folded(contacts[i][0]) for pair in sample for i in pair}
+    start = time.perf_counter()
+    for i, j in sample:
+        score(contacts[i], contacts[j], names[i], names[j])
+    pairwise = (time.perf_counter() - start) / len(sample) * len(contacts) * (len(contacts) - 1) / 2
+    timings = ", ".join(f"{stage} {seconds:.1f} s" for stage, seconds in found.timings.items())
+    print(f"dedupe, {len(contacts)} contacts, {found.workers} processes: {elapsed:.1f} s ({timings}), "
+          f"{found.pairs} candidate pairs, {found.skipped} blocks skipped; every pair would take "
+          f"~{pairwise / 3600:.0f} h")
+    kinds = ", ".join(f"{kind} {sum(pair in pairs for pair, shared in planted.items() if shared == kind)}/"
+                      f"{sum(shared == kind for shared in planted.values())}" for kind in ("phone", "email", "name"))
+    print(f"  planted duplicates found by what they share: {kinds}; other matches {len(pairs - planted.keys())}")
+
+
+LAZY_MODULES = ("rich", "prompt_toolkit", "sort_files", "sqlite3", "sqlstore", "numpy", "analytics", "dedupe",
+                "multiprocessing")
+
+
+def import_times(module):
+    # -X importtime rows are "self us | cumulative us | name", nested
+    # imports are indented under the module that pulled them in
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=startup_env(),
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((name.rstrip()[1:], int(own), int(cumulative)))
+    return rows
+
+
+def startup_env():
+    env = dict(os.environ)
+    # without cached bytecode every run would include compiling main.py
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def bench_startup(budget_ms=100, runs=7, module="main"):
+    import_times(module)
+    totals = []
+    for _ in range(runs):
+        rows = import_times(module)
+        totals.append(next(cumulative for name, _, cumulative in rows if name.strip() == module) / 1000)
+    total = statistics.median(totals)
+    print(f"import {module}: {total:.1f} ms (медіана з {runs}), бюджет {budget_ms} ms")
+    direct = [(cumulative, name.strip()) for name, _, cumulative in rows if name.startswith("  ") and name[2] != " "]
+    for cumulative, name in sorted(direct, reverse=True)[:8]:
+        print(f"  {name:<24}{cumulative / 1000:8.1f} ms")
+    eager = sorted({name.strip() for name, _, _ in rows if name.strip().split(".")[0] in LAZY_MODULES})
+    if eager:
+        print(f"Завантажено під час старту: {', '.join(eager)}")
+    return 1 if total > budget_ms or eager else 0
+
+
+BENCHMARKS = {"find": bench_find_by_term, "memory": bench_memory, "import": bench_import, "server": bench_server,
+              "complete": bench_completion, "fuzzy": bench_fuzzy, "analytics": bench_analytics,
+              "compaction": bench_compaction, "dedupe": bench_dedupe}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки адресної книги")
+    parser.add_argument("benchmark", nargs="?", default="find", choices=[*BENCHMARKS, "suite", "startup"])
+    parser.add_argument("size", nargs="?", type=int, default=100_000)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 100_000],
+                        help="розміри книг для suite, напр. 1000 100000 1000000")
+    parser.add_argument("--save", metavar="FILE", help="зберегти результати suite у JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="порівняти з раніше збереженими результатами")
+    parser.add_argument("--budget", type=float, default=100, metavar="MS", help="ліміт часу імпорту main для startup")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустиме сповільнення p50 (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark == "suite":
+        sys.exit(bench_suite(args.sizes, args.save, args.baseline, args.tolerance))
+    if args.benchmark == "startup":
+        sys.exit(bench_startup(args.budget))
+    BENCHMARKS[args.benchmark](args.size)
@@ -0,0 +1,215 @@
+from multiprocessing import get_context
+import os
+import time
+
+from indexes import edit_distance, fold_name, normalize_phone
+
+# a block this big is a shared office number or a very common name rather
+# than one person; all of its pairs would make the pass quadratic again
+MAX_BLOCK = 50
+THRESHOLD = 0.6
+CHUNK = 20_000
+
+# set in every worker by the pool initializer
+_contacts = None
+_folded = {}
+
+
+def contact_from_row(row):
+    # (name, phones, email, birthday, how much is filled in) for an exchange row
+    phones = tuple(normalize_phone(phone) for phone in row["phones"])
+    email, birthday = (row["email"] or "").strip().casefold(), row["birthday"] or ""
+    filled = len(phones) + len(row["notes"]) + bool(email) + bool(row["address"]) + bool(birthday)
+    return row["name"], phones, email, birthday, filled
+
+
+def folded(name):
+    # word order doesn't matter: Koval Oleksandr and Олександр Коваль match
+    return " ".join(sorted(fold_name(name)))
+
+
+def blocking_keys(name, phones, email):
+    # contacts sharing any key are compared, everyone else never is
+    words = folded(name)
+    keys = {"n" + words, "s" + " ".join(word[:4] for word in words.split())}
+    keys.update("p" + phone for phone in phones if phone)
+    if email:
+        keys.add("e" + email)
+    return keys
+
+
+def score(a, b, folded_a, folded_b):
+    # from 0 to 1: how alike the names are plus what else the two share;
+    # two different birthdays are strong evidence of two people
+    longest = max(len(folded_a), len(folded_b)) or 1
+    total = 0.6 * (1 - edit_distance(folded_a, folded_b, longest) / longest)
+    if set(a[1]) & set(b[1]):
+        total += 0.35
+    if a[2] and a[2] == b[2]:
+        total += 0.3
+    if a[3] and b[3]:
+        total += 0.1 if a[3] == b[3] else -0.5
+    return max(0.0, min(total, 1.0))
+
+
+def reasons(a, b):
+    shared = []
+    if set(a[1]) & set(b[1]):
+        shared.append("телефон")
+    if a[2] and a[2] == b[2]:
+        shared.append("email")
+    if a[3] and a[3] == b[3]:
+        shared.append("день народження")
+    if folded(a[0]) == folded(b[0]):
+        shared.append("ім'я")
+    return ", ".join(shared)
+
+
+def _init(contacts):
+    global _contacts, _folded
+    _contacts = contacts
+    _folded = {}
+
+
+def _folded_name(i):
+    name = _folded.get(i)
+    if name is None:
+        name = _folded[i] = folded(_contacts[i][0])
+    return name
+
+
+def _keys(span):
+    return [blocking_keys(*_contacts[i][:3]) for i in range(*span)]
+
+
+def _score(task):
+    pairs, size, threshold = task
+    found = []
+    for pair in pairs:
+        i, j = divmod(pair, size)
+        value = score(_contacts[i], _contacts[j], _folded_name(i), _folded_name(j))
+        if value >= threshold:
+            found.append((i, j, value))
+    return found
+
+
+def candidate_pairs(keys, max_block=MAX_BLOCK):
+    # pair (i, j) is stored as i * size + j, a set of ints is far smaller
+    # than a set of tuples
+    size = len(keys)
+    blocks = {}
+    for i, contact_keys in enumerate(keys):
+        for key in contact_keys:
+            # a hash collision only adds a pair that scoring turns down
+            key = hash(key)
+            members = blocks.get(key)
+            if members is None:
+                blocks[key] = i
+            elif isinstance(members, int):
+                blocks[key] = [members, i]
+            else:
+                members.append(i)
+    pairs = set()
+    skipped = 0
+    for members in blocks.values():
+        if isinstance(members, int):
+            continue
+        if len(members) > max_block:
+            skipped += 1
+            continue
+        for x, i in enumerate(members):
+            for j in members[x + 1:]:
+                if i != j:
+                    pairs.add(i * size + j)
+    return pairs, skipped
+
+
+def group(contacts, matches):
+    # union-find over the accepted pairs, best pairs first; every group is one
+    # person. Two groups with different birthdays or emails stay apart even if
+    # some contact without either matches both
+    parent = list(range(len(contacts)))
+    known = {}
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def clash(a, b):
+        return any(x and y and x != y for x, y in zip(known.get(a, contacts[a][2:4]), known.get(b, contacts[b][2:4])))
+
+    for i, j, _ in sorted(matches, key=lambda match: -match[2]):
+        a, b = root(i), root(j)
+        if a == b or clash(a, b):
+            continue
+        fields = known.get(a, contacts[a][2:4])
+        other = known.get(b, contacts[b][2:4])
+        a, b = min(a, b), max(a, b)
+        parent[b] = a
+        known[a] = tuple(x or y for x, y in zip(fields, other))
+    groups = {}
+    for i, j, _ in matches:
+        if root(i) == root(j):
+            groups.setdefault(root(i), set()).update((i, j))
+    return list(groups.values())
+
+
+class Duplicates:
+    def __init__(self, contacts, threshold=THRESHOLD, workers=None, max_block=MAX_BLOCK):
+        self.contacts = contacts
+        self.threshold = threshold
+        self.workers = workers or os.cpu_count() or 1
+        self.timings = {}
+        size = len(contacts)
+        spans = [(start, min(start + CHUNK, size)) for start in range(0, size, CHUNK)]
+        pool = get_context().Pool(self.workers, _init, (contacts,)) if self.workers > 1 and size > CHUNK else None
+        if pool is None:
+            _init(contacts)
+        run = pool.imap if pool else map
+        try:
+            start = time.perf_counter()
+            keys = [contact_keys for part in run(_keys, spans) for contact_keys in part]
+            self.timings["keys"] = time.perf_counter() - start
+            start = time.perf_counter()
+            pairs, self.skipped = candidate_pairs(keys, max_block)
+            del keys
+            self.pairs = len(pairs)
+            pairs = sorted(pairs)
+            self.timings["blocks"] = time.perf_counter() - start
+            start = time.perf_counter()
+            tasks = ((pairs[i:i + CHUNK], size, threshold) for i in range(0, len(pairs), CHUNK))
+            matches = [match for part in run(_score, tasks) for match in part]
+            self.timings["scoring"] = time.perf_counter() - start
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.matches = len(matches)
+        groups = group(contacts, matches)
+        member_of = {i: number for number, members in enumerate(groups) for i in members}
+        best = {}
+        for i, j, value in matches:
+            if member_of.get(i) != member_of.get(j):
+                continue
+            for one in (i, j):
+                best[one] = max(best.get(one, 0), value)
+        # the most complete contact stays, the others are merged into it
+        self.groups = []
+        for members in groups:
+            keep = min(members, key=lambda i: (-contacts[i][4], contacts[i][0]))
+            others = sorted((i for i in members if i != keep), key=lambda i: contacts[i][0])
+            self.groups.append((keep, [(i, best[i]) for i in others]))
+        self.groups.sort(key=lambda item: contacts[item[0]][0])
+
+    @property
+    def duplicates(self):
+        return sum(len(others) for _, others in self.groups)
+
+    def rows(self):
+        # (group, kept name, duplicate name, score, what they share) for the report
+        for number, (keep, others) in enumerate(self.groups, 1):
+            for i, value in others:
+                yield (number, self.contacts[keep][0], self.contacts[i][0], f"{value:.2f}",
+                       reasons(self.contacts[keep], self.contacts[i]))
@@ -0,0 +1,99 @@
+import csv
+import json
+from pathlib import Path
+import re
+
+FIELDS = ["name", "phones", "email", "address", "birthday", "notes"]
+PHONES_RE = re.compile(r"(?:[0-9]{10}\n)*")
+# what an unreadable line comes out as, so the import counts it as rejected
+BAD_ROW = {"name": "", "phones": [], "email": None, "address": None, "birthday": None, "notes": None}
+
+
+def file_format(path):
+    suffix = Path(path).suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError("Підтримуються лише файли .csv та .jsonl")
+
+
+def valid_phones(phones):
+    # one regex pass over the whole batch; only a batch that fails is
+    # checked phone by phone to find the bad ones
+    if PHONES_RE.fullmatch("".join(phone + "\n" for phone in phones)):
+        return [True] * len(phones)
+    return [len(phone) == 10 and phone.isascii() and phone.isdigit() for phone in phones]
+
+
+def _split_phones(value):
+    if isinstance(value, str):
+        return [phone.strip() for phone in value.split(";") if phone.strip()]
+    return [str(phone) for phone in value or ()]
+
+
+def _normalize(row):
+    notes = row.get("notes") or []
+    if isinstance(notes, str):
+        try:
+            notes = json.loads(notes)
+        except ValueError:
+            # the import rejects the row, like any other bad one
+            notes = None
+    return {
+        "name": (row.get("name") or "").strip(),
+        "phones": _split_phones(row.get("phones")),
+        "email": row.get("email") or None,
+        "address": row.get("address") or None,
+        "birthday": row.get("birthday") or None,
+        "notes": notes,
+    }
+
+
+def _undecodable(text):
+    # bytes that aren't UTF-8 are read as lone surrogates (surrogateescape)
+    try:
+        text.encode("utf-8")
+    except UnicodeEncodeError:
+        return True
+    return False
+
+
+def read_rows(path):
+    # a row with bytes that aren't UTF-8 is rejected on its own instead of
+    # ending the import there
+    fmt = file_format(path)
+    with open(path, encoding="utf-8", errors="surrogateescape", newline="") as file:
+        if fmt == "csv":
+            for row in csv.DictReader(file):
+                values = [value for value in row.values() if isinstance(value, str)]
+                yield dict(BAD_ROW) if _undecodable("".join(values)) else _normalize(row)
+        else:
+            for line in file:
+                if _undecodable(line):
+                    yield dict(BAD_ROW)
+                elif line.strip():
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        row = None
+                    yield _normalize(row) if isinstance(row, dict) else dict(BAD_ROW)
+
+
+def write_rows(path, rows):
+    fmt = file_format(path)
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if fmt == "csv":
+            writer = csv.DictWriter(file, FIELDS)
+            writer.writeheader()
+            for row in rows:
+                row["phones"] = ";".join(row["phones"])
+                row["notes"] = json.dumps(row["notes"], ensure_ascii=False) if row["notes"] else ""
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                count += 1
+    return count
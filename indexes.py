@@ -0,0 +1,547 @@
+from bisect import bisect_left, insort
+from calendar import isleap
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+import heapq
+from itertools import chain, product
+import math
+import re
+
+TOKEN_RE = re.compile(r"\w+")
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+REPEATED_RE = re.compile(r"(\w)\1+")
+
+CYRILLIC = "абвгґдеєжзиіїйклмнопрстуфхцчшщьюяёыэъ"
+LATIN = ("a", "b", "v", "h", "g", "d", "e", "ie", "zh", "z", "y", "i", "i", "i", "k", "l", "m", "n", "o", "p",
+         "r", "s", "t", "u", "f", "kh", "ts", "ch", "sh", "shch", "", "iu", "ia", "e", "y", "e", "")
+TRANSLIT = {}
+for c, l in zip(CYRILLIC, LATIN):
+    TRANSLIT[ord(c)] = l
+    TRANSLIT[ord(c.upper())] = l.title()
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.casefold())
+
+
+def parse_tags(tags):
+    if not tags:
+        return set()
+    if isinstance(tags, str):
+        tags = re.split(r"[,;\s]+", tags)
+    return {tag.strip().lstrip("#").casefold() for tag in tags if tag.strip().lstrip("#")}
+
+
+class NGramIndex:
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = defaultdict(set)
+        self.texts = {}
+
+    def grams(self, text):
+        n = self.n
+        if len(text) < n:
+            return {text} if text else set()
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def set(self, key, texts):
+        texts = tuple(texts)
+        old = set()
+        for text in self.texts.pop(key, ()):
+            old |= self.grams(text)
+        new = set()
+        for text in texts:
+            new |= self.grams(text)
+        for gram in old - new:
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+        for gram in new - old:
+            self.postings[gram].add(key)
+        if texts:
+            self.texts[key] = texts
+
+    def remove(self, key):
+        self.set(key, ())
+
+    def candidates(self, term):
+        if not term:
+            return set(self.texts)
+        if len(term) >= self.n:
+            lists = sorted((self.postings.get(gram, ()) for gram in self.grams(term)), key=len)
+            if not lists[0]:
+                return set()
+            return set(lists[0]).intersection(*lists[1:])
+        # shorter than a gram: every text containing the term has a gram
+        # containing it, and there are far fewer grams than records
+        result = set()
+        for gram, keys in self.postings.items():
+            if term in gram:
+                result |= keys
+        return result
+
+
+class SearchIndex:
+    EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+    def __init__(self):
+        self.names = NGramIndex()
+        self.phones = NGramIndex()
+
+    def add(self, key, name, phones):
+        self.names.set(key, (name.casefold(),))
+        self.phones.set(key, phones)
+
+    def set_phones(self, key, phones):
+        self.phones.set(key, phones)
+
+    def remove(self, key):
+        self.names.remove(key)
+        self.phones.remove(key)
+
+    def search(self, term):
+        ranked = {}
+        if term.isdigit():
+            for key in self.phones.candidates(term):
+                scores = [self._score(phone, (phone,), term) for phone in self.phones.texts[key] if term in phone]
+                if scores:
+                    ranked[key] = min(scores)
+        folded = term.casefold()
+        for key in self.names.candidates(folded):
+            name = self.names.texts[key][0]
+            if folded in name:
+                score = self._score(name, name.split(), folded)
+                ranked[key] = min(ranked.get(key, score), score)
+        return sorted(ranked, key=lambda key: (ranked[key], key))
+
+    def _score(self, text, tokens, term):
+        if text == term:
+            return self.EXACT
+        if any(token.startswith(term) for token in tokens):
+            return self.PREFIX
+        return self.SUBSTRING
+
+
+def normalize_phone(phone):
+    # +38 (050) 123-45-67 and 0501234567 are the same number
+    return "".join(c for c in phone if c.isdigit())[-10:]
+
+
+class LookupIndex:
+    # exact value -> keys, for "whose number is this" style questions
+    def __init__(self):
+        self.keys = defaultdict(set)
+        self.values = {}
+
+    def set(self, key, values):
+        values = frozenset(value for value in values if value)
+        for value in self.values.pop(key, frozenset()) - values:
+            keys = self.keys[value]
+            keys.discard(key)
+            if not keys:
+                del self.keys[value]
+        for value in values:
+            self.keys[value].add(key)
+        if values:
+            self.values[key] = values
+
+    def remove(self, key):
+        self.set(key, ())
+
+    def get(self, value):
+        return self.keys.get(value, set())
+
+    def get_all(self, values):
+        lists = sorted((self.get(value) for value in values), key=len)
+        if not lists:
+            return set()
+        return lists[0].intersection(*lists[1:])
+
+
+class NameIndex:
+    # (casefolded, name) pairs kept sorted, so a prefix lookup is one
+    # bisect and a short slice however big the book is
+    def __init__(self, names=()):
+        self.entries = sorted((name.casefold(), name) for name in names)
+
+    def add(self, name):
+        entry = (name.casefold(), name)
+        i = bisect_left(self.entries, entry)
+        if i == len(self.entries) or self.entries[i] != entry:
+            self.entries.insert(i, entry)
+
+    def remove(self, name):
+        entry = (name.casefold(), name)
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def complete(self, prefix, limit=20):
+        folded = prefix.casefold()
+        found = []
+        i = bisect_left(self.entries, (folded,))
+        while i < len(self.entries) and len(found) < limit:
+            key, name = self.entries[i]
+            if not key.startswith(folded):
+                break
+            found.append(name)
+            i += 1
+        return found
+
+
+def fold_name(text, transliterate=True):
+    # Олександр, Oleksandr and Olexandr all end up as "oleksandr"
+    text = text.casefold()
+    if transliterate:
+        text = text.translate(TRANSLIT)
+        text = text.replace("x", "ks").replace("ph", "f").replace("w", "v").replace("kh", "h")
+        text = REPEATED_RE.sub(r"\1", text.replace("y", "i").replace("j", "i"))
+    return TOKEN_RE.findall(text)
+
+
+def edit_distance(a, b, limit):
+    return distances(a, (b,), limit)[0]
+
+
+def distances(a, words, limit):
+    # Levenshtein distances from a with Myers' bit-vector algorithm: one pass
+    # over each word with a handful of integer operations per character;
+    # anything over limit comes back as limit + 1
+    masks = {}
+    for i, c in enumerate(a):
+        masks[c] = masks.get(c, 0) | 1 << i
+    full = (1 << len(a)) - 1
+    last = 1 << len(a) - 1 if a else 0
+    result = []
+    for b in words:
+        if abs(len(a) - len(b)) > limit or not a:
+            result.append(min(max(len(a), len(b)), limit + 1))
+            continue
+        plus, minus, score = full, 0, len(a)
+        for c in b:
+            eq = masks.get(c, 0)
+            x = eq | minus
+            horizontal = (((eq & plus) + plus) ^ plus) | eq
+            up = minus | ~(horizontal | plus) & full
+            down = plus & horizontal
+            if up & last:
+                score += 1
+            elif down & last:
+                score -= 1
+            up = (up << 1 | 1) & full
+            down = down << 1 & full
+            plus = down | ~(x | up) & full
+            minus = up & x
+        result.append(min(score, limit + 1))
+    return result
+
+
+class FuzzyIndex:
+    # names are split into folded tokens and every query token is matched
+    # against the distinct tokens through a trigram index, so the cost
+    # follows the number of distinct name parts, not the number of contacts
+    CANDIDATES = 100
+
+    def __init__(self, max_distance=2, transliterate=True):
+        self.max_distance = max_distance
+        self.transliterate = transliterate
+        # one trigram index per token length: a match can't be longer or
+        # shorter by more than max_distance, so the rest is never counted
+        self.grams = defaultdict(NGramIndex)
+        self.tokens = {}
+        self.by_key = {}
+
+    def set(self, key, name):
+        self.remove(key)
+        tokens = tuple(fold_name(name, self.transliterate))
+        for token in tokens:
+            keys = self.tokens.get(token)
+            if keys is None:
+                keys = self.tokens[token] = set()
+                self.grams[len(token)].set(token, (f"${token}$",))
+            keys.add(key)
+        if tokens:
+            self.by_key[key] = tokens
+
+    def remove(self, key):
+        for token in self.by_key.pop(key, ()):
+            keys = self.tokens[token]
+            keys.discard(key)
+            if not keys:
+                del self.tokens[token]
+                self.grams[len(token)].remove(token)
+
+    def similar(self, token):
+        # two typos in a four-letter name leave hardly anything of it
+        limit = min(self.max_distance, max(1, len(token) // 3))
+        indexes = [self.grams[length] for length in range(len(token) - limit, len(token) + limit + 1)
+                   if length in self.grams]
+        if not indexes:
+            return {}
+        grams = indexes[0].grams(f"${token}$")
+        # an edit breaks at most n grams, so anything sharing fewer can't match
+        need = max(1, len(grams) - limit * indexes[0].n)
+        counts = Counter(chain.from_iterable(index.postings.get(gram, ()) for index in indexes for gram in grams))
+        candidates = [candidate for candidate, count in counts.items() if count >= need]
+        if len(candidates) > self.CANDIDATES:
+            candidates = heapq.nlargest(self.CANDIDATES, candidates, key=counts.__getitem__)
+        return {candidate: distance
+                for candidate, distance in zip(candidates, distances(token, candidates, limit))
+                if distance <= limit}
+
+    def search(self, query, limit=5):
+        matches = [self.similar(token) for token in fold_name(query, self.transliterate)]
+        if not matches or not all(matches):
+            return []
+        # for every query token: the contacts at each distance from it
+        groups = []
+        for found in matches:
+            by_distance = defaultdict(list)
+            for token, distance in found.items():
+                by_distance[distance].append(self.tokens[token])
+            groups.append({distance: set().union(*keys) for distance, keys in by_distance.items()})
+        # contacts with a smaller total distance come first, found by set
+        # intersections rather than by looking at the contacts one by one
+        result = []
+        seen = set()
+        for total in range(sum(max(group) for group in groups) + 1):
+            found = set()
+            for combination in product(*groups):
+                if sum(combination) == total:
+                    keys = sorted((group[distance] for group, distance in zip(groups, combination)), key=len)
+                    found |= keys[0].intersection(*keys[1:])
+            found -= seen
+            seen |= found
+            result.extend((key, total) for key in heapq.nsmallest(limit - len(result), found))
+            if len(result) >= limit:
+                break
+        return result
+
+
+def anniversary(born, year):
+    # Feb 29 birthdays are celebrated on Feb 28 in non-leap years
+    if born.month == 2 and born.day == 29 and not isleap(year):
+        return date(year, 2, 28)
+    return date(year, born.month, born.day)
+
+
+def next_birthday(born, today):
+    this_year = anniversary(born, today.year)
+    if this_year >= today:
+        return this_year
+    return anniversary(born, today.year + 1)
+
+
+class BirthdayIndex:
+    def __init__(self):
+        self.buckets = defaultdict(set)
+        self.dates = {}
+
+    def set(self, key, born):
+        self.remove(key)
+        if born is not None:
+            self.dates[key] = born
+            self.buckets[(born.month, born.day)].add(key)
+
+    def remove(self, key):
+        born = self.dates.pop(key, None)
+        if born is not None:
+            bucket = self.buckets[(born.month, born.day)]
+            bucket.discard(key)
+            if not bucket:
+                del self.buckets[(born.month, born.day)]
+
+    def days_to(self, key, today=None):
+        born = self.dates.get(key)
+        if born is None:
+            return -1
+        today = today or date.today()
+        return (next_birthday(born, today) - today).days
+
+    def upcoming(self, days, today=None):
+        today = today or date.today()
+        result = []
+        seen = set()
+        for offset in range(min(days, 365) + 1):
+            day = today + timedelta(days=offset)
+            keys = self.buckets.get((day.month, day.day), set())
+            if day.month == 2 and day.day == 28 and not isleap(day.year):
+                keys = keys | self.buckets.get((2, 29), set())
+            for key in sorted(keys - seen):
+                result.append((offset, key))
+            seen |= keys
+        return result
+
+
+class TagIndex:
+    # notes are identified by (contact key, position in its notes list), so
+    # the index never holds on to the note objects themselves
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.entries = {}
+        self.by_key = {}
+
+    def set_notes(self, key, notes):
+        for i in range(self.by_key.pop(key, 0)):
+            tags, _ = self.entries.pop((key, i))
+            for tag in tags:
+                self.postings[tag].discard((key, i))
+                if not self.postings[tag]:
+                    del self.postings[tag]
+        count = 0
+        for i, note in enumerate(notes):
+            self.entries[(key, i)] = (frozenset(note.tags), note.date)
+            for tag in note.tags:
+                self.postings[tag].add((key, i))
+            count += 1
+        if count:
+            self.by_key[key] = count
+
+    def parse_query(self, expression):
+        # "a b OR c -d" means (a AND b) OR (c AND NOT d)
+        groups = [([], [])]
+        negate = False
+        for word in expression.split():
+            upper = word.upper()
+            if upper == "OR":
+                groups.append(([], []))
+            elif upper == "NOT":
+                negate = True
+            elif upper != "AND":
+                if word.startswith("-"):
+                    negate, word = True, word[1:]
+                tag = parse_tags(word)
+                if tag:
+                    groups[-1][1 if negate else 0].extend(tag)
+                negate = False
+        return [group for group in groups if group[0] or group[1]]
+
+    def match(self, expression):
+        found = set()
+        for include, exclude in self.parse_query(expression):
+            if include:
+                lists = sorted((self.postings.get(tag, set()) for tag in include), key=len)
+                notes = lists[0].intersection(*lists[1:])
+            else:
+                notes = set(self.entries)
+            for tag in exclude:
+                notes = notes - self.postings.get(tag, set())
+            found |= notes
+        return found
+
+    def search(self, expression, start=None, end=None, offset=0, limit=None):
+        notes = self.match(expression) if expression else self.entries
+        by_date = lambda note_id: self.entries[note_id][1]
+        if start or end:
+            notes = [note_id for note_id in notes
+                     if (not start or by_date(note_id) >= start) and (not end or by_date(note_id)[:len(end)] <= end)]
+        if limit is None:
+            ordered = sorted(notes, key=by_date)
+        else:
+            ordered = heapq.nsmallest(offset + limit, notes, key=by_date)
+        return len(notes), ordered[offset:]
+
+
+class FullTextIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.vocabulary = []
+        self.lengths = {}
+        self.entries = {}
+        self.by_key = {}
+        self.total_length = 0
+
+    def set_notes(self, key, notes):
+        for i in range(self.by_key.pop(key, 0)):
+            self._remove((key, i))
+        count = 0
+        for i, note in enumerate(notes):
+            self._add((key, i), note.value)
+            count += 1
+        if count:
+            self.by_key[key] = count
+
+    def _add(self, note, text):
+        tokens = tokenize(text or "")
+        positions = defaultdict(list)
+        for position, token in enumerate(tokens):
+            positions[token].append(position)
+        for term, where in positions.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                insort(self.vocabulary, term)
+            docs[note] = where
+        self.entries[note] = tuple(positions)
+        self.lengths[note] = len(tokens)
+        self.total_length += len(tokens)
+
+    def _remove(self, note):
+        terms = self.entries.pop(note)
+        self.total_length -= self.lengths.pop(note)
+        for term in terms:
+            docs = self.postings[term]
+            del docs[note]
+            if not docs:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+    def expand(self, prefix):
+        terms = []
+        i = bisect_left(self.vocabulary, prefix)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix):
+            terms.append(self.vocabulary[i])
+            i += 1
+        return terms
+
+    def _score(self, term, note):
+        docs = self.postings[term]
+        count = len(self.lengths)
+        idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+        tf = len(docs[note])
+        norm = 1 - self.b + self.b * self.lengths[note] * count / (self.total_length or 1)
+        return idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+
+    def _phrase(self, tokens):
+        lists = [self.postings.get(token, {}) for token in tokens]
+        candidates = set(min(lists, key=len)).intersection(*lists)
+        found = {}
+        for note in candidates:
+            following = [set(docs[note]) for docs in lists[1:]]
+            if any(all(start + i + 1 in where for i, where in enumerate(following)) for start in lists[0][note]):
+                found[note] = sum(self._score(token, note) for token in set(tokens))
+        return found
+
+    def _clause(self, phrase, word):
+        tokens = tokenize(phrase or word)
+        if not tokens:
+            return None
+        if phrase or len(tokens) > 1:
+            return self._phrase(tokens)
+        if word.endswith("*"):
+            found = defaultdict(float)
+            for term in self.expand(tokens[0]):
+                for note in self.postings[term]:
+                    found[note] += self._score(term, note)
+            return found
+        return {note: self._score(tokens[0], note) for note in self.postings.get(tokens[0], ())}
+
+    def search(self, query, offset=0, limit=10):
+        scores = None
+        for phrase, word in QUERY_RE.findall(query):
+            found = self._clause(phrase, word)
+            if found is None:
+                continue
+            if scores is None:
+                scores = dict(found)
+            else:
+                scores = {note: score + found[note] for note, score in scores.items() if note in found}
+            if not scores:
+                break
+        if not scores:
+            return 0, []
+        best = heapq.nlargest(offset + limit, scores.items(), key=lambda item: item[1])
+        return len(scores), [(key, i, score) for (key, i), score in best[offset:]]
@@ -1,28 +1,54 @@
 from collections import UserDict
-from datetime import datetime
-import cmd
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timedelta
+from functools import lru_cache, wraps
+from itertools import islice
+import csv
+import gc
+import os
 import pickle
 from pathlib import Path
 from typing import List
 from abc import ABC, abstractmethod
 import sys
-from prompt_toolkit import prompt
-from prompt_toolkit.completion import WordCompleter
-from prompt_toolkit.completion import NestedCompleter
-from prompt_toolkit.validation import Validator, ValidationError
-from rich.console import Console
-from rich.table import Table
+import threading
+import time
 import re
-from sort_files import run
+import weakref
+from storage import Autosaver, Journal, LazyRecords, RecordStore, Snapshot, is_snapshot, write_snapshot
+from exchange import read_rows, valid_phones, write_rows
+from indexes import (BirthdayIndex, FullTextIndex, FuzzyIndex, LookupIndex, NameIndex, SearchIndex, TagIndex,
+                     next_birthday, normalize_phone, parse_tags, tokenize)
+from metrics import metrics
 
-console = Console()
+
+# rich and prompt_toolkit take most of the start-up time, so they are
+# imported by the first command that draws a table or asks for input
+@lru_cache(maxsize=None)
+def get_console():
+    from rich.console import Console
+    return Console()
+
+
+def slot_state(state):
+    # slotted objects pickle as (dict, slots); books written before the
+    # classes got __slots__ pickled a plain __dict__
+    if isinstance(state, tuple):
+        return {**(state[0] or {}), **(state[1] or {})}
+    return state
 
 
 class Field:
+    __slots__ = ("_value",)
+
     def __init__(self, value):
         self._value = None
         self.value = value
 
+    def __setstate__(self, state):
+        for key, value in slot_state(state).items():
+            setattr(self, key, value)
+
     @property
     def value(self):
         return self._value
@@ -32,92 +58,175 @@ class Field:
         self._value = new_value
 
     def __str__(self):
-        return str(self._value)
+        return str(self.value)
 
     def validate(self):
         pass
 
 
 class Name(Field):
+    __slots__ = ()
+
     def __init__(self, name):
         super().__init__(name)
 
+    @Field.value.setter
+    def value(self, new_value):
+        self._value = sys.intern(new_value)
+
 
 class Phone(Field):
+    # stored as an int, a 10-digit string costs almost twice as much
+    __slots__ = ()
 
     def validate(self):
-        if self._value and not (isinstance(self._value, str) and len(self._value) == 10 and self._value.isdigit()):
+        if not 0 <= self._value < 10 ** 10:
             raise ValueError("Phone must be a 10-digit number.")
 
-    @Field.value.setter
+    @property
+    def value(self):
+        return f"{self._value:010d}"
+
+    @value.setter
     def value(self, new_value):
         if not isinstance(new_value, str) or not new_value.isdigit():
             raise ValueError("Phone must be a string containing only digits.")
-        self._value = new_value
-        self.validate()
+        if len(new_value) != 10:
+            raise ValueError("Phone must be a 10-digit number.")
+        self._value = int(new_value)
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if isinstance(self._value, str):
+            self._value = int(self._value)
+
+    @classmethod
+    def from_digits(cls, digits):
+        # for phones already checked in bulk by exchange.valid_phones
+        phone = cls.__new__(cls)
+        phone._value = int(digits)
+        return phone
 
 class Address(Field):
+    __slots__ = ()
+
     def __init__(self, value):
         super().__init__(value)
 
 
-# class Email(Field):
-#     @Field.value.setter
-#     def value(self, new_value):
-#         result = re.findall (r"[a-zA-Z0-9_.]+@\w+\.\w{2,3}", new_value)
-#         try:
-#             self._value = result[0]
-#         except IndexError:
-#             raise IndexError ("E-mail must be 'name@domain'")
+class Email(Field):
+    __slots__ = ()
 
-# class Birthday(Field):
-
-#     @Field.value.setter
-#     def value(self, new_value):
+    @Field.value.setter
+    def value(self, new_value):
+        result = re.findall (r"[a-zA-Z0-9_.]+@\w+\.\w{2,3}", new_value)
+        try:
+            self._value = result[0]
+        except IndexError:
+            raise ValueError ("E-mail must be 'name@domain'")
 
-#         try:
-#             datetime.strptime(new_value, "%Y-%m-%d")
-#         except ValueError:
-#             raise ValueError("Invalid date format!!! Use YYYY-MM-DD.")
+class Birthday(Field):
+    __slots__ = ("date",)
 
-#         self._value = new_value
+    @Field.value.setter
+    def value(self, new_value):
 
+        try:
+            self.date = datetime.strptime(new_value, "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError("Invalid date format!!! Use YYYY-MM-DD.")
 
-# class Record:
-#     def __init__(self, name, email=None, address=None, birthday=None):
-#         self.name = Name(name)
-#         self.phones = []
-#         self.email = Email(email) if email else None
-#         self.address = Address(address) if address else None
-#         self.birthday = Birthday(birthday) if birthday else None
+        self._value = new_value
 
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if not hasattr(self, "date"):
+            self.date = datetime.strptime(self._value, "%Y-%m-%d").date()
+
+
+def mutation(method):
+    # the change and its journal entry happen under the book lock, so a
+    # background save never sees one without the other. Mutations replace
+    # lists and fields instead of editing them, open snapshots keep the
+    # record as it was (AddressBook.snapshot)
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.book is None:
+            return method(self, *args, **kwargs)
+        with self.book.lock:
+            self.book.preserve(self.name.value, self)
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Record:
+    __slots__ = ("name", "phones", "email", "address", "birthday", "book")
+
+    def __init__(self, name, email=None, address=None, birthday=None):
+        self.book = None
+        self.name = Name(name)
+        self.phones = []
+        self.email = Email(email) if email else None
+        self.address = Address(address) if address else None
+        self.birthday = Birthday(birthday) if birthday else None
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if slot != "book" and hasattr(self, slot):
+                    state[slot] = getattr(self, slot)
+        return state
+
+    def __setstate__(self, state):
+        self.book = None
+        for key, value in slot_state(state).items():
+            if key != "book":
+                setattr(self, key, value)
+
+    def _changed(self, op, *args):
+        if self.book is not None:
+            self.book.record_changed(self, op, *args)
+
+    @mutation
     def add_phone(self, phone):
         phone_field = Phone(phone)
         phone_field.validate()
-        self.phones.append(phone_field)
+        self.phones = [*self.phones, phone_field]
+        self._changed("add_phone", phone)
 
+    @mutation
     def add_email(self, email):
         email_field = Email(email)
         email_field.validate()
         self.email = email_field
+        self._changed("add_email", email)
     
+    @mutation
     def add_address(self, address):
         address_field = Address(address)
         self.address = address_field    
+        self._changed("add_address", address)
 
 
+    @mutation
     def add_birthday(self, birthday):
         new_birthday = Birthday(birthday)
         self.birthday = new_birthday
+        self._changed("add_birthday", birthday)
 
+    @mutation
     def remove_phone(self, phone):
         self.phones = list(filter(lambda p: p.value != phone, self.phones))
+        self._changed("remove_phone", phone)
 
 
+    @mutation
     def edit_phone(self, old_phone, new_phone):
-        for p in self.phones:
+        for i, p in enumerate(self.phones):
             if p.value == old_phone:
-                p.value = new_phone
+                self.phones = [*self.phones[:i], Phone(new_phone), *self.phones[i + 1:]]
+                self._changed("edit_phone", old_phone, new_phone)
                 return
         raise ValueError("not on the list!!")
 
@@ -137,12 +246,7 @@ class Address(Field):
             return -1
 
         today = datetime.now().date()
-        next_birthday = datetime.strptime(self.birthday.value, "%Y-%m-%d").date().replace(year=today.year)
-        if today > next_birthday:
-            next_birthday = next_birthday.replace(year=today.year + 1)
-
-        days_until_birthday = (next_birthday - today).days
-        return days_until_birthday
+        return (next_birthday(self.birthday.date, today) - today).days
 
 
 class Printer(ABC):
@@ -157,18 +261,192 @@ class ConsolePrint(Printer):
 
 
 
+def synchronized(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class AddressBook(UserDict):
     record_id = None
+    # bumped by every change, so derived data knows when it is out of date
+    mutations = 0
+    # snapshot section name -> attribute
+    INDEXES = {"search": "index", "birthdays": "birthdays", "tags": "tags", "fulltext": "fulltext",
+               "phones": "phones", "emails": "emails", "addresses": "addresses"}
 
-    def __init__(self, file="adress_book_1.pkl"):
+    def __init__(self, file="adress_book_1.pkl", compact_min=1000, cache_size=10000):
         self.file = Path(file)
         self.record_id = 0
         self.record = {}
+        self.journal = Journal(self.file.with_suffix(".journal"))
+        self.compact_min = compact_min
+        self.cache_size = cache_size
+        self.seq = 0
+        self._replaying = False
+        self.lock = threading.RLock()
+        # one compaction at a time, taken before the book lock, never after
+        self.compacting = threading.Lock()
+        # set on every journaled change, waited on by the autosaver
+        self.changed = threading.Event()
+        self.snapshots = weakref.WeakSet()
+        # changes that are in memory only, without a journal entry (imports)
+        self.unsaved = False
         super().__init__()
+        self._reset()
+
+    def _reset(self, store=None):
+        # a file still read through a snapshot is closed when that goes away
+        if isinstance(self.data, LazyRecords) and self.data.store is not None and not self.snapshots:
+            self.data.store.close()
+        self.data = LazyRecords(store, self.cache_size, loaded=self._loaded)
+        self.index = SearchIndex()
+        self.birthdays = BirthdayIndex()
+        self.tags = TagIndex()
+        self.fulltext = FullTextIndex()
+        self.phones = LookupIndex()
+        self.emails = LookupIndex()
+        self.addresses = LookupIndex()
+        self.names = None
+        self.fuzzy = None
+        self._columns = None
+        self.mutations += 1
+        # indexes of a snapshot are only read on the first query that needs them
+        self._indexed = store is None
+
+    def _loaded(self, record):
+        record.book = self
+
+    def snapshot(self):
+        # the book as it is now, for reading while it keeps changing; close
+        # it (or use it in a with block) so changes stop being kept for it
+        with self.lock:
+            snapshot = Snapshot(self.data, self.seq, self.record_id)
+            self.snapshots.add(snapshot)
+        return snapshot
+
+    def preserve(self, name, record=None):
+        # under the lock, before `name` is changed, added or deleted
+        if not self.snapshots:
+            return
+        if record is None:
+            record = self.data.get(name)
+        for snapshot in list(self.snapshots):
+            snapshot.preserve(name, record)
+
+    def _log(self, op, name, *args):
+        self.mutations += 1
+        if self._replaying:
+            return
+        self.seq += 1
+        self.journal.append((self.seq, op, name, args))
+        self.changed.set()
+
+    @synchronized
+    def record_changed(self, record, op, *args):
+        name = record.name.value
+        self.data.touch(name, record)
+        if self._indexed:
+            if op in ("add_phone", "edit_phone", "remove_phone"):
+                self.index.set_phones(name, [phone.value for phone in record.phones])
+                self.phones.set(name, [phone.value for phone in record.phones])
+            elif op == "add_email":
+                self.emails.set(name, [record.email.value.casefold()])
+            elif op == "add_address":
+                self.addresses.set(name, tokenize(record.address.value))
+            elif op == "add_birthday":
+                self.birthdays.set(name, record.birthday.date)
+            elif op in ("add_note", "remove_note", "edit_note", "clear_notes"):
+                self.tags.set_notes(name, record.notes)
+                self.fulltext.set_notes(name, record.notes)
+            elif op == "merge_record":
+                self._reindex(name, record)
+        self._log(op, name, *args)
+
+    def _reindex(self, name, record):
+        if record is None:
+            self.index.remove(name)
+            self.birthdays.remove(name)
+            self.tags.set_notes(name, ())
+            self.fulltext.set_notes(name, ())
+            self.phones.remove(name)
+            self.emails.remove(name)
+            self.addresses.remove(name)
+            return
+        self.index.add(name, record.name.value, [phone.value for phone in record.phones])
+        self.birthdays.set(name, record.birthday.date if record.birthday else None)
+        self.tags.set_notes(name, getattr(record, "notes", ()))
+        self.fulltext.set_notes(name, getattr(record, "notes", ()))
+        self.phones.set(name, [phone.value for phone in record.phones])
+        self.emails.set(name, [record.email.value.casefold()] if record.email else ())
+        self.addresses.set(name, tokenize(record.address.value) if record.address else ())
+
+    def _ensure_indexes(self):
+        if self._indexed:
+            return
+        with self.lock:
+            self._build_indexes()
 
+    def _build_indexes(self):
+        if self._indexed:
+            return
+        indexes = self.data.store.indexes()
+        # snapshots written before an index was added are indexed from scratch
+        if indexes and all(name in indexes for name in self.INDEXES):
+            for name, attribute in self.INDEXES.items():
+                setattr(self, attribute, indexes[name])
+            for name in self.data.changed():
+                self._reindex(name, self.data.get(name))
+        else:
+            for name, record in self.data.items():
+                self._reindex(name, record)
+        self._indexed = True
+
+    def name_index(self):
+        # sorted names for completion, built on first use and kept in step
+        # with the book from then on
+        if self.names is None:
+            with self.lock:
+                if self.names is None:
+                    self.names = NameIndex(self.data)
+        return self.names
+
+    def fuzzy_index(self):
+        if self.fuzzy is None:
+            with self.lock:
+                if self.fuzzy is None:
+                    fuzzy = FuzzyIndex()
+                    for name in self.data:
+                        fuzzy.set(name, name)
+                    self.fuzzy = fuzzy
+        return self.fuzzy
+
+    @synchronized
     def add_record(self, record):
+        self.preserve(record.name.value)
         self.data[record.name.value] = record
-
+        record.book = self
+        if self._indexed:
+            self._reindex(record.name.value, record)
+        if self.names is not None:
+            self.names.add(record.name.value)
+        if self.fuzzy is not None:
+            self.fuzzy.set(record.name.value, record.name.value)
+        self._log("add_record", record.name.value, record)
+
+    # reads go through the lock too: a lookup reorders the record cache and
+    # the server runs them next to mutations
+    @synchronized
+    def __getitem__(self, name):
+        return self.data[name]
+
+    @synchronized
+    def __contains__(self, name):
+        return name in self.data
+
+    @synchronized
     def find(self, term):
 
         if term in self.data:
@@ -176,103 +454,682 @@ class AddressBook(UserDict):
         else:
             return None
 
+    @synchronized
     def delete(self, name):
         if name in self.data:
-            del self.data[name]
+            self.preserve(name)
+            self.data.pop(name).book = None
+            if self._indexed:
+                self._reindex(name, None)
+            if self.names is not None:
+                self.names.remove(name)
+            if self.fuzzy is not None:
+                self.fuzzy.remove(name)
+            self._log("delete", name)
+
+    @synchronized
+    def merge_contacts(self, name, duplicates):
+        # the duplicates' phones, notes and missing fields go into `name` and
+        # the duplicates are deleted; contacts gone in the meantime are skipped
+        record = self.data.get(name)
+        if not isinstance(record, NoteRecord):
+            return 0
+        merged = 0
+        for duplicate in duplicates:
+            other = self.data.get(duplicate)
+            if other is None or duplicate == name:
+                continue
+            record.merge_record(other)
+            self.delete(duplicate)
+            merged += 1
+        return merged
 
     def __iter__(self):
         return iter(self.data.values())
 
-    def iterator(self, item_number):
-        counter = 0
-        result = []
-        for item, record in self.data.items():
-            result.append(record)
-            counter += 1
-            if counter >= item_number:
-                yield result
-                counter = 0
-                result = []
+    @metrics.timed("book.iterator", pages=True)
+    def iterator(self, item_number, start_page=0):
+        # pages come from a snapshot, so a record edited while they are
+        # printed shows up whole, either before or after the edit
+        return chunked(self.snapshot().values(start_page * item_number), item_number)
 
+    @metrics.timed("book.dump")
     def dump(self):
-        with open(self.file, "wb") as file:
-            pickle.dump((self.record_id, dict(self.data)), file)
+        with self.lock:
+            metrics.add_bytes("book.dump", self.journal.flush())
+            due = (self.data.store is None or self.unsaved
+                   or self.journal.size >= max(self.compact_min, len(self.data)))
+        # outside the lock, so writers don't wait for the compaction
+        if due:
+            self.compact()
+
+    @metrics.timed("book.compact")
+    def compact(self):
+        # the records are written from a snapshot; writers only wait while the
+        # indexes are pickled and while the new file is swapped in. Returns
+        # False if another compaction is already running: what changed since
+        # its snapshot is in the journal, or in `unsaved` for the next one
+        if not self.compacting.acquire(blocking=False):
+            return False
+        try:
+            self._compact()
+        finally:
+            self.compacting.release()
+        return True
 
+    def _compact(self):
+        # with `compacting` held
+        with self.lock:
+            self.journal.flush()
+            mark = self.journal.mark()
+            self._ensure_indexes()
+            indexes = pickle.dumps({name: getattr(self, attribute) for name, attribute in self.INDEXES.items()})
+            self.unsaved = False
+            snapshot = self.snapshot()
+        with snapshot:
+            tmp = write_snapshot(self.file, snapshot.items(raw=True), snapshot.record_id, snapshot.seq, indexes)
+            with self.lock:
+                old = self.data
+                # the old mapping stays open for readers that still hold it and is
+                # closed once it is garbage collected
+                try:
+                    os.replace(tmp, self.file)
+                except PermissionError:
+                    # Windows doesn't replace a file that is still mapped
+                    old.store.close()
+                    os.replace(tmp, self.file)
+                metrics.add_bytes("book.compact", os.path.getsize(self.file))
+                data = LazyRecords(RecordStore(self.file), self.cache_size, loaded=self._loaded)
+                data.cache.update(old.cache)
+                # what changed while the file was written stays in memory
+                # (and in the journal) until the next compaction
+                for name in snapshot.versions:
+                    if name in old:
+                        data[name] = old[name]
+                    elif name in data:
+                        del data[name]
+                self.data = data
+                self.journal.truncate(mark)
+
+    @metrics.timed("book.load")
     def load(self):
-        if not self.file.exists():
-            return
-        with open(self.file, "rb") as file:
-            self.record_id, data = pickle.load(file)
-            self.data.update(data)
-
+        # a running compaction finishes first, it would bring back what
+        # the reload drops
+        with self.compacting, self.lock:
+            self._load()
+
+    def _load(self):
+        # reloading drops whatever was not saved yet
+        self.journal.pending.clear()
+        self.unsaved = False
+        self._reset()
+        self.seq = 0
+        if self.file.exists():
+            if is_snapshot(self.file):
+                store = RecordStore(self.file)
+                self._reset(store)
+                self.record_id, self.seq = store.record_id, store.seq
+            else:
+                # old books are a single (record_id, data[, seq]) pickle
+                with open(self.file, "rb") as file:
+                    state = pickle.load(file)
+                self.record_id, data = state[:2]
+                self.seq = state[2] if len(state) > 2 else 0
+                for name, record in data.items():
+                    self.data[name] = record
+                    record.book = self
+                    self._reindex(name, record)
+        self._replaying = True
+        try:
+            for seq, op, name, args in self.journal.replay():
+                if seq <= self.seq:
+                    continue
+                self._apply(op, name, args)
+                self.seq = seq
+        finally:
+            self._replaying = False
+
+    def _apply(self, op, name, args):
+        if op == "add_record":
+            self.add_record(args[0])
+        elif op == "delete":
+            self.delete(name)
+        elif name in self.data:
+            getattr(self.data[name], op)(*args)
+
+    def import_rows(self, rows, chunk_size=10000):
+        # bulk rows skip the journal: once `cache_size` of them are waiting
+        # they are spilled to a segment file, which costs what was imported
+        # rather than what the book holds, and the one compaction at the end
+        # writes them all. A running compaction finishes first and none
+        # starts meanwhile, it would decode every imported record back into
+        # memory to keep them out of its file
+        with self.compacting, self.lock:
+            frozen = gc.get_freeze_count()
+            try:
+                return self._import_rows(rows, chunk_size)
+            finally:
+                if not frozen:
+                    gc.unfreeze()
+
+    def _import_rows(self, rows, chunk_size):
+        added = merged = rejected = 0
+        error = None
+        # one insert at a time would make a big import quadratic; the name
+        # indexes are rebuilt on their next use instead
+        self.names = None
+        self.fuzzy = None
+        self.mutations += 1
+        try:
+            for chunk in chunked(rows, chunk_size):
+                records, failed = records_from_rows(chunk)
+                rejected += failed
+                for record in records:
+                    name = record.name.value
+                    existing = self.data.get(name)
+                    self.preserve(name, existing)
+                    if existing is None:
+                        self.data[name] = record
+                        record.book = self
+                        added += 1
+                    else:
+                        existing.merge(record)
+                        self.data.touch(name, existing)
+                        record = existing
+                        merged += 1
+                    if self._indexed:
+                        self._reindex(name, record)
+                self.unsaved = True
+                if len(self.data.dirty) >= self.cache_size:
+                    self.data.spill(self.file.parent)
+                    # the indexes only grow during an import; kept out of the
+                    # collections, they don't make every chunk slower than the last
+                    gc.freeze()
+        except (OSError, ValueError, csv.Error) as e:
+            if not added + merged + rejected:
+                raise
+            error = e
+        self.unsaved = True
+        self._compact()
+        if error is not None:
+            raise ImportFailed(error, added, merged, rejected)
+        return added, merged, rejected
+
+    def export_rows(self):
+        with self.snapshot() as snapshot:
+            for record in snapshot.values():
+                yield record_to_row(record)
+
+    @metrics.timed("book.find_by_term")
+    @synchronized
     def find_by_term(self, term: str) -> List[Record]:
-        matching_records = []
-
-        for record in self.data.values():
-            for phone in record.phones:
-                if term in phone.value:
-                    matching_records.append(record)
-
-        matching_records.extend(record for record in self.data.values() if term.lower() in record.name.value.lower())
-        return matching_records
+        self._ensure_indexes()
+        return [self.data[name] for name in self.index.search(term)]
+
+    @synchronized
+    def find_by_phone(self, phone):
+        self._ensure_indexes()
+        return [self.data[name] for name in sorted(self.phones.get(normalize_phone(phone)))]
+
+    @synchronized
+    def find_by_email(self, email):
+        self._ensure_indexes()
+        return [self.data[name] for name in sorted(self.emails.get(email.strip().casefold()))]
+
+    @synchronized
+    def find_by_address(self, address):
+        # every word of the query has to be in the address
+        self._ensure_indexes()
+        return [self.data[name] for name in sorted(self.addresses.get_all(tokenize(address)))]
+
+    @synchronized
+    def find_fuzzy(self, term, limit=5):
+        # typos and spelling variants: Olexandr, Oleksandr and Олександр
+        return [(self.data[name], distance) for name, distance in self.fuzzy_index().search(term, limit)]
+
+    @synchronized
+    def days_to_birthday(self, name):
+        self._ensure_indexes()
+        return self.birthdays.days_to(name)
+
+    @synchronized
+    def find_notes(self, query, start=None, end=None, page=1, page_size=20):
+        self._ensure_indexes()
+        total, found = self.tags.search(query, start, end, (page - 1) * page_size, page_size)
+        return total, [(name, self.data[name].notes[i]) for name, i in found]
+
+    @synchronized
+    def search_notes(self, query, page=1, page_size=10):
+        self._ensure_indexes()
+        total, found = self.fulltext.search(query, (page - 1) * page_size, page_size)
+        return total, [(name, self.data[name].notes[i], score) for name, i, score in found]
+
+    @synchronized
+    def upcoming_birthdays(self, days):
+        self._ensure_indexes()
+        return [(days_left, self.data[name]) for days_left, name in self.birthdays.upcoming(days)]
+
+    @synchronized
+    def columns(self):
+        # names, birthdays, phone and note counts per contact and notes per
+        # tag, read from the indexes so that no record has to be unpickled;
+        # phones are counted as distinct numbers
+        self._ensure_indexes()
+        names = list(self.data)
+        born, phones, notes = self.birthdays.dates, self.phones.values, self.tags.by_key
+        return (names, [born.get(name) for name in names], [len(phones.get(name, ())) for name in names],
+                [notes.get(name, 0) for name in names], {tag: len(keys) for tag, keys in self.tags.postings.items()})
+
+    def analytics(self):
+        # a columnar copy of the book for the reports, kept until it changes
+        from analytics import BookColumns
+        cached = self._columns
+        if cached is None or cached[0] != self.mutations:
+            with self.lock:
+                cached = self._columns
+                if cached is None or cached[0] != self.mutations:
+                    cached = (self.mutations, BookColumns(*self.columns()))
+                    self._columns = cached
+        return cached[1]
 
 
 class Note(Field):
+    __slots__ = ("tags", "date")
+
     def __init__(self, text, date, tags=None):
         super().__init__(text)
-        self.tags = tags
+        self.tags = parse_tags(tags)
         self.date = date
 
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if not isinstance(self.tags, set):
+            self.tags = parse_tags(self.tags)
 
     def add_tag(self, tag):
-        self.tags.appand(tag)
+        self.tags = self.tags | parse_tags(tag)
 
     def remove_tag(self, tag):
-        self.tags.remove(tag)
+        self.tags = self.tags - parse_tags(tag)
 
 class NoteRecord(Record):
+    __slots__ = ("notes",)
+
     def __init__(self, name, birthday=None):
         super().__init__(name, birthday=None)
         self.notes = []
 
-    def add_note(self, text, tags=None):
-        now = datetime.now()
-        date = now.strftime("%Y-%m-%d %H:%M:%S")
+    @mutation
+    def add_note(self, text, tags=None, date=None):
+        if date is None:
+            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         note = Note(text, date, tags)
-        self.notes.append(note)
+        self.notes = [*self.notes, note]
+        self._changed("add_note", text, tags, date)
 
+    @mutation
     def remove_note(self, text):
         if not text:
             raise ValueError("Введіть нотаток!")
         self.notes = [note for note in self.notes if note.value != text]
+        self._changed("remove_note", text)
 
+    @mutation
     def edit_note(self, old_text, new_text, new_tags=None):
-        for note in self.notes:
+        for i, note in enumerate(self.notes):
             if note.value == old_text:
-                note.value = new_text
-                if new_tags is not None:
-                    note.tags = new_tags
+                edited = Note(new_text, note.date, note.tags if new_tags is None else new_tags)
+                self.notes = [*self.notes[:i], edited, *self.notes[i + 1:]]
+                self._changed("edit_note", old_text, new_text, new_tags)
                 break
 
+    @mutation
+    def clear_notes(self):
+        self.notes = []
+        self._changed("clear_notes")
+
+    def merge(self, other):
+        # fills in what this record is missing, nothing already here is replaced
+        phones = list(self.phones)
+        known = {phone.value for phone in phones}
+        for phone in other.phones:
+            if phone.value not in known:
+                phones.append(phone)
+                known.add(phone.value)
+        self.phones = phones
+        self.email = self.email or other.email
+        self.address = self.address or other.address
+        self.birthday = self.birthday or other.birthday
+        seen = {(note.value, note.date) for note in self.notes}
+        self.notes = [*self.notes, *(note for note in getattr(other, "notes", ()) if (note.value, note.date) not in seen)]
+
+    @mutation
+    def merge_record(self, other):
+        # merge() for a record that stays in the book, journaled like any edit
+        self.merge(other)
+        self._changed("merge_record", other)
+
     def find_notes_by_tag(self, tag):
-        return [note for note in self.notes if tag in note.teg]
+        tags = parse_tags(tag)
+        return [note for note in self.notes if tags <= note.tags]
 
     def __str__(self):
-        notes_str = " | ".join([f"{note.value} [{' ,'.join(note.tags)}]" for note in self.notes])
+        notes_str = " | ".join([f"{note.value} [{', '.join(sorted(note.tags))}]" for note in self.notes])
         return f"NoteRecord(name={self.name.value}, notes={notes_str})"
 
 
+def writable(path):
+    path = Path(path)
+    if path.exists():
+        return path.is_file() and os.access(path, os.W_OK)
+    return path.parent.is_dir() and os.access(path.parent, os.W_OK)
+
+
+def valid_page(page, page_size):
+    return page.isdigit() and page_size.isdigit() and int(page) >= 1 and int(page_size) >= 1
+
+
+def parse_options(line, options):
+    words = line.split()
+    options = dict(options)
+    rest = []
+    while words:
+        word = words.pop(0)
+        if options.get(word) is False:
+            options[word] = True
+        elif word in options and words:
+            options[word] = words.pop(0)
+        else:
+            rest.append(word)
+    return " ".join(rest), options
+
+
+def chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def book_row(record):
+    phones = '; '.join(str(phone) for phone in record.phones)
+    birthday_info = record.birthday.value if record.birthday else ""
+    address_info = record.address.value if record.address else ""
+    email_info = record.email.value if record.email else ""
+    return [record.name.value, record.name.value, phones, address_info, email_info, birthday_info]
+
+
+def tsv_cell(value):
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+def record_from_row(row, title=True):
+    record = NoteRecord(row["name"].title() if title else row["name"])
+    record.phones = [Phone.from_digits(phone) for phone in row["phones"]]
+    record.email = Email(row["email"]) if row["email"] else None
+    record.address = Address(row["address"]) if row["address"] else None
+    record.birthday = Birthday(row["birthday"]) if row["birthday"] else None
+    for note in row["notes"]:
+        date = note.get("date") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        record.notes.append(Note(note["text"], date, note.get("tags")))
+    return record
+
+
+class ImportFailed(Exception):
+    # a file that broke off part way; the rows before the error are imported
+    def __init__(self, error, added, merged, rejected):
+        super().__init__(str(error))
+        self.error = error
+        self.added, self.merged, self.rejected = added, merged, rejected
+
+
+def records_from_rows(rows):
+    # the valid rows as records and the number of rejected ones
+    flags = iter(valid_phones([phone for row in rows for phone in row["phones"]]))
+    records, rejected = [], 0
+    for row in rows:
+        phones = [phone for phone in row["phones"] if next(flags)]
+        if not row["name"] or row["notes"] is None or len(phones) != len(row["phones"]):
+            rejected += 1
+            continue
+        try:
+            records.append(record_from_row(row))
+        except (ValueError, TypeError, KeyError):
+            rejected += 1
+    return records, rejected
+
+
+def record_to_row(record):
+    return {
+        "name": record.name.value,
+        "phones": [phone.value for phone in record.phones],
+        "email": record.email.value if record.email else "",
+        "address": record.address.value if record.address else "",
+        "birthday": record.birthday.value if record.birthday else "",
+        "notes": [{"text": note.value, "tags": sorted(note.tags), "date": note.date}
+                  for note in getattr(record, "notes", ())],
+    }
+
+
+class SqliteAddressBook(AddressBook):
+    # the same book on top of sqlstore: every change goes straight into an
+    # open transaction and dump() commits it, so there is no journal or
+    # snapshot, and queries are answered by sqlite's indexes
+    def __init__(self, file="adress_book.db", cache_size=10000):
+        self.store = None
+        super().__init__(file, cache_size=cache_size)
+
+    def _reset(self, store=None):
+        from sqlstore import SqlRecords, SqlStore
+        if self.store is None:
+            self.store = SqlStore(self.file)
+        self.data = SqlRecords(self.store, self._from_row, record_to_row, self.cache_size, self.lock)
+        self.names = None
+        self.fuzzy = None
+        self._columns = None
+        self.mutations += 1
+        # there are no in-memory indexes to keep up to date
+        self._indexed = False
+
+    def _from_row(self, row):
+        # names are stored exactly as they were added
+        record = record_from_row(row, title=False)
+        record.book = self
+        return record
+
+    def _log(self, op, name, *args):
+        self.mutations += 1
+        self.changed.set()
+
+    @synchronized
+    def record_changed(self, record, op, *args):
+        self.data[record.name.value] = record
+        self._log(op, record.name.value, *args)
+
+    def _ensure_indexes(self):
+        pass
+
+    def snapshot(self):
+        # sqlite has no snapshot file to write, so there is nothing for a
+        # save to pin; listings read it page by page as everywhere else here
+        return self.data
+
+    @metrics.timed("book.iterator", pages=True)
+    def iterator(self, item_number, start_page=0):
+        return chunked(self.data.values(start_page * item_number), item_number)
+
+    def export_rows(self):
+        # the rows are already in the exchange layout
+        after = 0
+        while True:
+            with self.lock:
+                rows, after = self.store.page(after)
+            if after is None:
+                return
+            yield from rows
+
+    @metrics.timed("book.dump")
+    @synchronized
+    def dump(self):
+        self.store.commit()
+
+    @metrics.timed("book.compact")
+    @synchronized
+    def compact(self):
+        self.store.checkpoint()
+        metrics.add_bytes("book.compact", os.path.getsize(self.file))
+
+    @metrics.timed("book.load")
+    @synchronized
+    def load(self):
+        # reloading drops whatever was not saved yet
+        self.store.rollback()
+        self.data.clear_cache()
+        self.names = None
+        self.fuzzy = None
+        self.mutations += 1
+
+    @synchronized
+    def import_rows(self, rows, chunk_size=10000):
+        added = merged = rejected = 0
+        error = None
+        self.names = None
+        self.fuzzy = None
+        self.mutations += 1
+        try:
+            for chunk in chunked(rows, chunk_size):
+                records, failed = records_from_rows(chunk)
+                rejected += failed
+                for record in records:
+                    name = record.name.value
+                    if name in self.data:
+                        existing = self.data[name]
+                        existing.merge(record)
+                        record = existing
+                        merged += 1
+                    else:
+                        record.book = self
+                        added += 1
+                    self.data[name] = record
+        except (OSError, ValueError, csv.Error) as e:
+            if not added + merged + rejected:
+                raise
+            error = e
+        self.store.commit()
+        if error is not None:
+            raise ImportFailed(error, added, merged, rejected)
+        return added, merged, rejected
+
+    @metrics.timed("book.find_by_term")
+    @synchronized
+    def find_by_term(self, term: str) -> List[Record]:
+        return self.data.many(self.store.search(term))
+
+    @synchronized
+    def find_by_phone(self, phone):
+        return self.data.many(self.store.by_phone(phone))
+
+    @synchronized
+    def find_by_email(self, email):
+        return self.data.many(self.store.by_email(email))
+
+    @synchronized
+    def find_by_address(self, address):
+        return self.data.many(self.store.by_address(address))
+
+    @synchronized
+    def days_to_birthday(self, name):
+        born = self.store.birthday(name)
+        if born is None:
+            return -1
+        today = datetime.now().date()
+        return (next_birthday(datetime.strptime(born, "%Y-%m-%d").date(), today) - today).days
+
+    @synchronized
+    def upcoming_birthdays(self, days):
+        today = datetime.now().date()
+        found = []
+        for name, born in self.store.birthdays_between(today, today + timedelta(days=min(days, 365))):
+            days_left = (next_birthday(datetime.strptime(born, "%Y-%m-%d").date(), today) - today).days
+            if days_left <= days:
+                found.append((days_left, name))
+        found.sort()
+        return list(zip([days_left for days_left, _ in found], self.data.many(name for _, name in found)))
+
+    @synchronized
+    def find_notes(self, query, start=None, end=None, page=1, page_size=20):
+        total, found = self.store.notes_by_tags(query, start, end, (page - 1) * page_size, page_size)
+        records = self.data.many(name for name, _ in found)
+        return total, [(name, record.notes[i]) for (name, i), record in zip(found, records)]
+
+    @synchronized
+    def search_notes(self, query, page=1, page_size=10):
+        total, found = self.store.search_notes(query, (page - 1) * page_size, page_size)
+        records = self.data.many(name for name, _, _ in found)
+        return total, [(name, record.notes[i], score) for (name, i, score), record in zip(found, records)]
+
+    @synchronized
+    def columns(self):
+        return self.store.columns()
+
+
+SQLITE_SUFFIXES = {".db", ".sqlite", ".sqlite3"}
+
+
+def open_book(file):
+    if Path(file).suffix.lower() in SQLITE_SUFFIXES:
+        return SqliteAddressBook(file)
+    return AddressBook(file)
+
+
+def migrate_book(source, target):
+    # a pickle book (snapshot and journal) into a new sqlite one
+    old = AddressBook(source)
+    old.load()
+    new = SqliteAddressBook(target)
+    count = 0
+    for row in old.export_rows():
+        new.store.save(row)
+        count += 1
+    new.store.commit()
+    new.compact()
+    return count
+
+
 class Controller():
-    def __init__(self):
+    def __init__(self, book=None):
         super().__init__()
-        self.book = AddressBook()
+        self.book = book if book is not None else AddressBook()
+        # batch mode answers the follow-up questions from the script itself
+        self.input = input
+        self.jobs = []
+        self.autosaver = None
+
+    def start_autosave(self, delay):
+        on_error = lambda e: print(f"Помилка автозбереження: {e}")
+        self.autosaver = Autosaver(self.book.dump, self.book.changed, delay, on_error)
+        self.autosaver.start()
 
     def do_exit(self):
+        # a sort killed half way would lose its manifest and could leave a
+        # half-copied file behind
+        if any(job.is_alive() for job in self.jobs):
+            print("Очікування завершення сортування файлів...")
+        self.wait_jobs()
+        if self.autosaver is not None:
+            self.autosaver.stop()
+            self.autosaver = None
         self.book.dump()
         print("Адресна книга збережена! Вихід...")
         return True
     
     def do_save(self):
+        if self.autosaver is not None:
+            self.autosaver.save_now()
+            print("Адресна книга зберігається у фоні")
+            return
         self.book.dump()
         print("Адресна книга збережена!")
 
@@ -281,7 +1138,7 @@ class Controller():
         print("Адресна книга відновлена")
 
     def do_add_name(self):
-        line = input("Введіть: <Ім'я>: ")
+        line = self.input("Введіть: <Ім'я>: ")
         name = line.strip().title()
 
         if name in self.book:
@@ -328,7 +1185,7 @@ class Controller():
         if not record:
             print(f"Контакт з іменем {name} не знайдено.")
             return
-        email = input('Введіть email:  ')
+        email = self.input('Введіть email:  ')
         try:
             record.add_email(email)
             print(f"Email {email} додано до контакта {name}.")
@@ -340,7 +1197,7 @@ class Controller():
         if not record:
             print(f"Контакт з іменем {name} не знайдено.")
             return
-        address = input('Введіть адрес: ')
+        address = self.input('Введіть адрес: ')
         try:
             record.add_address(address)
             print(f"Адреса {address} додана до контакта {name}.")
@@ -348,57 +1205,100 @@ class Controller():
             print(f"Помилка при додаванні адреси: {e}")
 
 
-    def do_list_book(self):
+    def _page_options(self, line, page_size):
+        _, options = parse_options(line, {"--page": None, "--page-size": str(page_size), "--tsv": False})
+        page, page_size = options["--page"] or "1", options["--page-size"]
+        if not valid_page(page, page_size):
+            print("Номер і розмір сторінки повинні бути додатними числами")
+            return None
+        return int(page), int(page_size), options["--page"] is not None, options["--tsv"]
+
+    def _print_pages(self, pages, columns, first_page, single, tsv):
+        # pages are rendered one at a time, so the first rows show up
+        # without walking the whole book
+        if single:
+            pages = islice(pages, 1)
+        if tsv:
+            sys.stdout.write("\t".join(columns) + "\n")
+        for number, rows in enumerate(pages, first_page):
+            if tsv:
+                sys.stdout.write("".join("\t".join(tsv_cell(cell) for cell in row) + "\n" for row in rows))
+                continue
+            from rich.table import Table
+            table = Table(show_header=True, header_style="bold magenta", show_lines=True, caption=f"Сторінка {number}")
+            for column in columns:
+                if column == "Date":
+                    table.add_column(column, style="dim", width=12)
+                else:
+                    table.add_column(column)
+            for row in rows:
+                table.add_row(*row)
+            get_console().print(table)
+
+    def do_list_book(self, line=""):
         if not self.book.data:
             print("Адресна книга порожня.")
-        else:
-            table = Table(show_header=True, header_style="bold magenta")
-            table.add_column('ID')
-            table.add_column('Name')
-            table.add_column("Phone")
-            table.add_column("Address")
-            table.add_column("Email")
-            table.add_column("Birthdays")
-            for record_id, record in self.book.data.items():
-                phones = '; '.join(str(phone) for phone in record.phones)
-                birthday_info = record.birthday.value if record.birthday else ""
-                address_info = record.address.value if record.address else ""
-                email_info = record.email.value if record.email else ""
-                table.add_row(record_id, record.name.value, phones, address_info, email_info, birthday_info)
-                table.add_section()
-            console.print(table)
+            return
+        options = self._page_options(line, 50)
+        if options is None:
+            return
+        page, page_size, single, tsv = options
+        pages = ([book_row(record) for record in chunk] for chunk in self.book.iterator(page_size, page - 1))
+        self._print_pages(pages, ("ID", "Name", "Phone", "Address", "Email", "Birthdays"), page, single, tsv)
 
-    def do_list_note(self):
+    def do_list_note(self, line=""):
         if not self.book.data:
             print("Адресна книга порожня.")
-        else:
-            table = Table(show_header=True, header_style="bold magenta")
-            table.add_column('Author')
-            table.add_column("Note")
-            table.add_column("Tag")
-            table.add_column("Date", style="dim", width=12)
-            for name, record in self.book.data.items():
-                if isinstance(record, NoteRecord) and record.notes:
-                    for h in record.notes:
-                        table.add_row(name, h.value, h.tags, h.date)
-                        table.add_section()
-            console.print(table)
+            return
+        options = self._page_options(line, 50)
+        if options is None:
+            return
+        page, page_size, single, tsv = options
+        notes = ((name, note) for name, record in self.book.snapshot().items() for note in getattr(record, "notes", ()))
+        pages = ([[name, note.value, ", ".join(sorted(note.tags)), note.date] for name, note in chunk]
+                 for chunk in chunked(islice(notes, (page - 1) * page_size, None), page_size))
+        self._print_pages(pages, ("Author", "Note", "Tag", "Date"), page, single, tsv)
 
     def do_find_info(self, line):
-        matching_records = self.book.find_by_term(line)
-        if matching_records:
-            for record in matching_records:
-                phones = ", ".join(phone.value for phone in record.phones )
-                birthday_info = f", День народження: {record.birthday.value}" if record.birthday else ""
-                print(f" {record.name.value}, {phones}{birthday_info}")
-        else:
+        term, options = parse_options(line, {"--fuzzy": False})
+        matching_records = [] if options["--fuzzy"] else self.book.find_by_term(term)
+        if not matching_records:
+            matching_records = [record for record, _ in self.book.find_fuzzy(term)]
+            if matching_records and not options["--fuzzy"]:
+                print("Точних збігів немає, схожі контакти:")
+        self._print_records(matching_records)
+
+    def _print_records(self, records):
+        if not records:
             print("Ничего не найдено!!!.")
+        for record in records:
+            phones = ", ".join(phone.value for phone in record.phones )
+            birthday_info = f", День народження: {record.birthday.value}" if record.birthday else ""
+            print(f" {record.name.value}, {phones}{birthday_info}")
+
+    def do_find_phone(self, phone):
+        self._print_records(self.book.find_by_phone(phone))
+
+    def do_find_email(self, email):
+        self._print_records(self.book.find_by_email(email))
+
+    def do_find_address(self, address):
+        self._print_records(self.book.find_by_address(address))
 
     def do_days_to_birthday(self, line):
         name = line.strip().title()
         record = self.book.find(name)
+        if record is None:
+            matches = self.book.find_fuzzy(name)
+            if len(matches) == 1 or len(matches) > 1 and matches[0][1] < matches[1][1]:
+                record = matches[0][0]
+                print(f"контакт {name} не знайдений, найближчий збіг: {record.name.value}")
+                name = record.name.value
+            elif matches:
+                print(f"контакт {name} не знайдений, можливо: {', '.join(record.name.value for record, _ in matches)}")
+                return
         if record:
-            days_until_birthday = record.days_to_birthday()
+            days_until_birthday = self.book.days_to_birthday(name)
             if days_until_birthday > 0:
                 print(f"до дня народження контакту {name}, залишилось {days_until_birthday} днів")
             elif days_until_birthday == 0:
@@ -419,8 +1319,8 @@ class Controller():
         if not isinstance(record, NoteRecord):
             print(f"Для контакта {name} не підтримуються нотатки.")
             return
-        note_text = input('Введіть нотатку: ')
-        tags = input('Введіть теги: ')
+        note_text = self.input('Введіть нотатку: ')
+        tags = self.input('Введіть теги: ')
         record.add_note(note_text, tags)
         print(f"Заметка додана до контакта {name}.")
 
@@ -433,16 +1333,46 @@ class Controller():
 
         if isinstance(record, NoteRecord) and record.notes:
             for note in record.notes:
-                print(f"{name}: {note.value} [Tags: {''.join(note.tags)}]")
+                print(f"{name}: {note.value} [Tags: {', '.join(sorted(note.tags))}]")
         else:
             print(f"Для контакта {name} не знайдено нотаток або вони не підтримуються.")
 
+    def do_find_tag(self, line):
+        query, options = parse_options(line, {"--from": None, "--to": None, "--page": "1", "--page-size": "20"})
+        if not valid_page(options["--page"], options["--page-size"]):
+            print("Номер і розмір сторінки повинні бути додатними числами")
+            return
+        page, page_size = int(options["--page"]), int(options["--page-size"])
+        total, notes = self.book.find_notes(query, options["--from"], options["--to"], page, page_size)
+        if not notes:
+            print("Нотаток не знайдено.")
+            return
+        for name, note in notes:
+            print(f"{note.date} {name}: {note.value} [Tags: {', '.join(sorted(note.tags))}]")
+        pages = (total + page_size - 1) // page_size
+        print(f"Сторінка {page} з {pages}, всього нотаток: {total}")
+
+    def do_search_notes(self, line):
+        query, options = parse_options(line, {"--page": "1", "--page-size": "10"})
+        if not valid_page(options["--page"], options["--page-size"]):
+            print("Номер і розмір сторінки повинні бути додатними числами")
+            return
+        page, page_size = int(options["--page"]), int(options["--page-size"])
+        total, notes = self.book.search_notes(query, page, page_size)
+        if not notes:
+            print("Нотаток не знайдено.")
+            return
+        for name, note, score in notes:
+            print(f"[{score:.2f}] {name}: {note.value} ({note.date})")
+        pages = (total + page_size - 1) // page_size
+        print(f"Сторінка {page} з {pages}, всього нотаток: {total}")
+
     def do_delete_all_notes(self, line):
-        name = input("Введіть ім'я для видалення всіх нотаток: ")
+        name = self.input("Введіть ім'я для видалення всіх нотаток: ")
         if name in self.book:
             record = self.book[name]
             if isinstance(record, NoteRecord):
-                record.notes.clear()
+                record.clear_notes()
                 print(f"Усі нотатки для {name} було видалено.")
             else:
                 print("Для цього контакта нотатки не підтримуються.")
@@ -452,14 +1382,68 @@ class Controller():
     def do_edit_note(self, line):
         pass
 
+    def do_import(self, path):
+        start = time.perf_counter()
+        try:
+            added, merged, rejected = self.book.import_rows(read_rows(path))
+        except FileNotFoundError:
+            print(f"Файл {path} не знайдено")
+            return
+        except ImportFailed as e:
+            print(f"Помилка імпорту: {e}. До неї імпортовано: нових {e.added}, об'єднано {e.merged}, "
+                  f"відхилено {e.rejected}")
+            return
+        except (OSError, ValueError, csv.Error) as e:
+            print(f"Помилка імпорту: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        total = added + merged + rejected
+        print(f"Імпортовано: нових {added}, об'єднано {merged}, відхилено {rejected} "
+              f"({total / (elapsed or 1e-9):.0f} рядків/с)")
+
+    def do_export(self, path):
+        start = time.perf_counter()
+        try:
+            count = write_rows(path, self.book.export_rows())
+        except (OSError, ValueError) as e:
+            print(f"Помилка експорту: {e}")
+            return
+        elapsed = time.perf_counter() - start
+        print(f"Експортовано {count} контактів у {path} ({count / (elapsed or 1e-9):.0f} рядків/с)")
+
+    def do_help(self):
+        for name, command in COMMANDS.items():
+            usage = command.usage.removeprefix("Введіть:").strip().rstrip(".")
+            print(f"{name} {usage}".rstrip())
+
     def do_sort_files(self, line):
         if not line:
             print("Введіть шлях до папки, яку треба сортувати")
             return
-        try:
-            run (line)
-        except FileNotFoundError:
+        if not Path(line).is_dir():
             print ('Така папка не існує на диску. Можливо треба ввести повний шлях\n')
+            return
+        # sorting runs in the background so the prompt stays usable
+        job = threading.Thread(target=self._sort_files, args=(line,), daemon=True)
+        self.jobs.append(job)
+        job.start()
+        print(f"Сортування {line} запущено у фоні")
+
+    def _sort_files(self, line):
+        progress = lambda stats: print(f"[sort_files] {line}: переміщено {stats['moved']}, пропущено {stats['skipped']}")
+        try:
+            from sort_files import run
+            stats = run(line, progress=progress)
+        except OSError as e:
+            print(f"[sort_files] {line}: помилка {e}")
+            return
+        print(f"[sort_files] {line}: готово. Переміщено {stats['moved']}, вже відсортовано {stats['skipped']}, "
+              f"невідомих {stats['unknown']}, розпаковано архівів {stats['extracted']}, помилок {stats['failed']}")
+
+    def wait_jobs(self):
+        for job in self.jobs:
+            job.join()
+        self.jobs.clear()
 
     def do_when (self, days):
         if not days:
@@ -468,138 +1452,372 @@ class Controller():
         if not days.isdigit():
             print ("Введіть кількість днів числовим значенням")
             return
-        for record in self.book:
-            self.do_days_to_birthday (record.name.value, int(days))
-
-
-class CommandValidator(Validator):
-    def validate(self, document):
-        text = document.text
-        if text.startswith("add_phone"):
-            x = text.split(" ")
-            if len(x) != 3:
-                raise ValidationError(message="Введіть: <Ім'я> <Телефон>", cursor_position = len(text))   
-            if(not x[2].isdigit()):
-                raise ValidationError(message='Телефон повинен складатися з цифр', cursor_position = len(text))
-        if text.startswith("add_birthday"):
-            x = text.split(" ")
-            if len(x) != 3:
-                raise ValidationError(message="Введіть: <Ім'я> <датa народження>.", cursor_position = len(text))   
-        if text.startswith("find_info"):
-            x = text.split(" ")
-            if len(x) == 1:
-                raise ValidationError(message="Введіть: дані для пошуку", cursor_position = len(text))   
-            
-        if text.startswith("days_to_birthday"):
-            x = text.split(" ")
-            if len(x) != 2:
-                raise ValidationError(message='Введіть: дані для пошуку', cursor_position = len(text))
-            
-        if text.startswith("add_note"):
-            x = text.split(" ")
-            if len(x) != 2:
-                raise ValidationError(message="Введіть: <Ім'я>", cursor_position = len(text))
-            
-        if text.startswith("find_note"):
-            x = text.split(" ")
-            if len(x) != 2:
-                raise ValidationError(message="Введіть: дані для пошуку", cursor_position = len(text)) 
-            
-        if text.startswith("delete_all_notes"):
-            x = text.split(" ")
-            if len(x) != 2:
-                raise ValidationError(message="Введіть: <Ім'я>", cursor_position = len(text)) 
-            
-        if text.startswith("add_email"):
-            x = text.split(" ")
-            if len(x) != 2:
-                raise ValidationError(message="Введіть: <Ім'я>", cursor_position = len(text)) 
-            
-        if text.startswith("add_address"):
-            x = text.split(" ")
-            if len(x) != 2:
-                raise ValidationError(message="Введіть: <Ім'я>", cursor_position = len(text)) 
-            
-            
+        upcoming = self.book.upcoming_birthdays(int(days))
+        if not upcoming:
+            print (f"Протягом {days} днів днів народження немає")
+            return
+        for days_left, record in upcoming:
+            if days_left == 0:
+                print (f"{record.name.value}: день народження сьогодні!!! ({record.birthday.value})")
+            else:
+                print (f"{record.name.value}: через {days_left} днів ({record.birthday.value})")
+
+    def do_analytics(self, line=""):
+        _, options = parse_options(line, {"--days": "30", "--top": "10"})
+        if not options["--days"].isdigit() or not options["--top"].isdigit():
+            print("Кількість днів і рядків повинна бути числом")
+            return
+        try:
+            columns = self.book.analytics()
+        except ImportError:
+            print("Для аналітики потрібен numpy: pip install numpy")
+            return
+        days, top = int(options["--days"]), int(options["--top"])
+        from rich.table import Table
+        console = get_console()
+        missing = columns.without_phones()
+        print(f"Контактів: {len(columns)}, без телефону: {len(missing)}")
+        if len(missing):
+            print("  " + ", ".join(missing[:top]) + (" ..." if len(missing) > top else ""))
+        table = Table(title="Дні народження за місяцями", show_header=True, header_style="bold magenta")
+        for month in ("Січ", "Лют", "Бер", "Кві", "Тра", "Чер", "Лип", "Сер", "Вер", "Жов", "Лис", "Гру"):
+            table.add_column(month, justify="right")
+        table.add_row(*(str(count) for count in columns.birthdays_by_month()))
+        console.print(table)
+        upcoming = columns.upcoming(days, datetime.now().date())
+        print(f"Днів народження протягом {days} днів: {len(upcoming)}")
+        for days_left, name in upcoming[:top]:
+            print(f"  {name}: {'сьогодні' if days_left == 0 else f'через {days_left} днів'}")
+        for title, header, rows in (("Нотатки за тегами", "Тег", columns.notes_by_tag(top)),
+                                    ("Нотатки за контактами", "Контакт", columns.notes_by_contact(top))):
+            if not rows:
+                continue
+            table = Table(title=title, show_header=True, header_style="bold magenta")
+            table.add_column(header)
+            table.add_column("Нотаток", justify="right")
+            for key, count in rows:
+                table.add_row(key, str(count))
+            console.print(table)
+
+    def do_dedupe(self, line=""):
+        _, options = parse_options(line, {"--apply": False, "--threshold": None, "--workers": None, "--out": None})
+        from dedupe import THRESHOLD, Duplicates, contact_from_row
+        try:
+            threshold = float(options["--threshold"] or THRESHOLD)
+            workers = int(options["--workers"] or 0) or None
+        except ValueError:
+            threshold = -1
+        if not 0 <= threshold <= 1:
+            print("Поріг повинен бути числом від 0 до 1, кількість процесів цілим числом")
+            return
+        start = time.perf_counter()
+        contacts = [contact_from_row(row) for row in self.book.export_rows()]
+        found = Duplicates(contacts, threshold, workers)
+        elapsed = time.perf_counter() - start
+        print(f"Контактів: {len(contacts)}, пар для порівняння: {found.pairs}, збігів: {found.matches}, "
+              f"пропущено завеликих блоків: {found.skipped}")
+        print(f"Груп дублікатів: {len(found.groups)}, дублікатів: {found.duplicates} "
+              f"({elapsed:.1f} с, процесів: {found.workers})")
+        if options["--out"]:
+            try:
+                with open(options["--out"], "w", encoding="utf-8") as file:
+                    file.write("група\tзалишається\tдублікат\tоцінка\tспільне\n")
+                    for row in found.rows():
+                        file.write("\t".join(map(str, row)) + "\n")
+            except OSError as e:
+                # nothing is merged without the report that was asked for
+                print(f"Помилка запису звіту: {e}")
+                return
+            print(f"Повний звіт записано у {options['--out']}")
+        if found.groups:
+            from rich.table import Table
+            table = Table(show_header=True, header_style="bold magenta")
+            for column in ("Група", "Залишається", "Дублікат", "Оцінка", "Спільне"):
+                table.add_column(column)
+            for row in islice(found.rows(), 20):
+                table.add_row(*map(str, row))
+            get_console().print(table)
+        if not options["--apply"]:
+            if found.groups:
+                print("Це пробний запуск, для об'єднання введіть dedupe --apply")
+            return
+        merged = 0
+        for keep, others in found.groups:
+            merged += self.book.merge_contacts(contacts[keep][0], [contacts[i][0] for i, _ in others])
+        print(f"Об'єднано {merged} контактів")
+
+    def do_stats(self, line=""):
+        _, options = parse_options(line, {"--on": False, "--off": False, "--reset": False,
+                                          "--profile": None, "--memory": None, "--out": None})
+        if options["--on"]:
+            metrics.enabled = True
+        if options["--off"]:
+            metrics.enabled = False
+        if options["--reset"]:
+            metrics.reset()
+        commands = options["--profile"] or options["--memory"]
+        if commands:
+            if not commands.isdigit() or int(commands) < 1:
+                print("Кількість команд повинна бути додатним числом")
+                return
+            memory = options["--profile"] is None
+            file = options["--out"] or ("memory.txt" if memory else "profile.prof")
+            # the file is written after the last of those commands, a bad
+            # path has to be caught now
+            if not writable(file):
+                print(f"Неможливо записати у {file}")
+                return
+            metrics.start_capture(int(commands), file, memory)
+            print(f"Наступні {commands} команд буде записано у {file}")
+            return
+        if not metrics.stats:
+            state = "увімкнена" if metrics.enabled else "вимкнена (stats --on або запуск з --stats)"
+            print(f"Даних ще немає, статистика {state}")
+            return
+        from rich.table import Table
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Операція", no_wrap=True)
+        for column in ("Викликів", "Помилок", "Сер. мс", "p50 мс", "p99 мс", "Макс. мс", "Байтів"):
+            table.add_column(column, justify="right")
+        with metrics.lock:
+            stats = sorted(metrics.stats.items(), key=lambda item: -item[1].total)
+        for name, stat in stats:
+            # p50/p99 are histogram bucket bounds, not exact values
+            table.add_row(name, str(stat.count), str(stat.errors), f"{stat.total / (stat.count or 1):.2f}",
+                          f"≤{stat.percentile(0.5):.2f}", f"≤{stat.percentile(0.99):.2f}", f"{stat.max:.2f}",
+                          str(stat.bytes) if stat.bytes else "")
+        get_console().print(table)
+
+
+class CommandError(ValueError):
+    pass
+
+
+class Command:
+    # args: "name"/"phone"/"date" are single words, "text" is the required
+    # rest of the line and "line" an optional one
+    LABELS = {"name": "<Ім'я>", "phone": "<Телефон>", "date": "<датa народження>", "text": "<дані для пошуку>", "line": "[параметри]"}
+    CHECKS = {"phone": (str.isdigit, "Телефон повинен складатися з цифр")}
+
+    def __init__(self, method, args=(), usage=None):
+        self.method = method
+        self.args = args
+        self.usage = usage or "Введіть: " + " ".join(self.LABELS[arg] for arg in args)
+
+    def parse(self, rest):
+        if self.args[-1:] == ("line",):
+            return (rest,)
+        if self.args[-1:] == ("text",):
+            if not rest:
+                raise CommandError(self.usage)
+            return (rest,)
+        words = rest.split()
+        if len(words) != len(self.args):
+            raise CommandError(self.usage)
+        for arg, word in zip(self.args, words):
+            if arg in self.CHECKS and not self.CHECKS[arg][0](word):
+                raise CommandError(self.CHECKS[arg][1])
+        return tuple(words)
+
+
+COMMANDS = {
+    'exit': Command("do_exit"),
+    'add_name': Command("do_add_name"),
+    'add_phone': Command("do_add_phone", ("name", "phone")),
+    'add_birthday': Command("do_add_birthday", ("name", "date"), "Введіть: <Ім'я> <датa народження>."),
+    'list_book': Command("do_list_book", ("line",), "Введіть: [--page N] [--page-size N] [--tsv]"),
+    'load': Command("do_load"),
+    'list_note': Command("do_list_note", ("line",), "Введіть: [--page N] [--page-size N] [--tsv]"),
+    'find_info': Command("do_find_info", ("text",), "Введіть: дані для пошуку [--fuzzy]"),
+    'find_phone': Command("do_find_phone", ("text",), "Введіть: <телефон>"),
+    'find_email': Command("do_find_email", ("text",), "Введіть: <email>"),
+    'find_address': Command("do_find_address", ("text",), "Введіть: <адреса або її частина>"),
+    'days_to_birthday': Command("do_days_to_birthday", ("name",), "Введіть: дані для пошуку"),
+    'add_note': Command("do_add_note", ("name",)),
+    'save': Command("do_save"),
+    'find_note': Command("do_find_note", ("name",), "Введіть: дані для пошуку"),
+    'find_tag': Command("do_find_tag", ("text",), "Введіть: <теги> [--from дата] [--to дата] [--page N] [--page-size N]"),
+    'search_notes': Command("do_search_notes", ("text",), 'Введіть: <слова>, "фраза" або префікс* [--page N] [--page-size N]'),
+    'delete_all_notes': Command("do_delete_all_notes", ("name",)),
+    'add_email': Command("do_add_email", ("name",)),
+    'add_address': Command("do_add_address", ("name",)),
+    'when': Command("do_when", ("line",), "Введіть: <кількість днів>"),
+    'edit_note': Command("do_edit_note", ("line",)),
+    'sort_files': Command("do_sort_files", ("line",), "Введіть: <папка>"),
+    'import': Command("do_import", ("text",), "Введіть: <файл.csv | файл.jsonl>"),
+    'export': Command("do_export", ("text",), "Введіть: <файл.csv | файл.jsonl>"),
+    'stats': Command("do_stats", ("line",), "Введіть: [--on | --off | --reset] [--profile N | --memory N] [--out файл]"),
+    'analytics': Command("do_analytics", ("line",), "Введіть: [--days N] [--top N]"),
+    'dedupe': Command("do_dedupe", ("line",), "Введіть: [--apply] [--threshold X] [--workers N] [--out файл.csv]"),
+    'help': Command("do_help"),
+}
+
+
+@lru_cache(maxsize=1)
+def parse_command(text):
+    # the validator and the dispatcher see the same text one after the other,
+    # so the second call is a cache hit
+    word, _, rest = text.strip().partition(" ")
+    if not word:
+        return None
+    command = COMMANDS.get(word.lower())
+    if command is None:
+        raise CommandError(f"Невідома команда: {word}. Введіть help")
+    return command, command.parse(rest.strip())
+
+
+def execute(controller, command, args):
+    with metrics.command(command.method[3:]):
+        return getattr(controller, command.method)(*args)
+
+
+def dispatch(controller, text):
+    parsed = parse_command(text)
+    if parsed is None:
+        return None
+    command, args = parsed
+    return execute(controller, command, args)
+
+
+def command_completer(book=None):
+    from prompt_toolkit.completion import Completer, Completion
+
+    class CommandCompleter(Completer):
+        # the first word completes to a command, arguments declared as
+        # "name" complete to contact names
+        def get_completions(self, document, complete_event):
+            text = document.text_before_cursor
+            words = text.split()
+            current = words[-1] if words and not text[-1].isspace() else ""
+            position = len(words) - 1 if current else len(words)
+            if position == 0:
+                for name in COMMANDS:
+                    if name.startswith(current.lower()):
+                        yield Completion(name, -len(current))
+                return
+            command = COMMANDS.get(words[0].lower())
+            if command is None or book is None or position > len(command.args):
+                return
+            if command.args[position - 1] == "name":
+                # names with spaces can't be typed as a single argument
+                for name in book.name_index().complete(current):
+                    if " " not in name:
+                        yield Completion(name, -len(current))
+
+    return CommandCompleter()
+
+
+def command_validator():
+    from prompt_toolkit.validation import Validator, ValidationError
+
+    class CommandValidator(Validator):
+        def validate(self, document):
+            text = document.text
+            try:
+                parse_command(text)
+            except CommandError as e:
+                raise ValidationError(message=str(e), cursor_position = len(text))
+
+    return CommandValidator()
+
+
 def handle_command(command):
-    if command.lower().startswith("add_name"):
-        return controller.do_add_name()
-    elif command.lower().startswith("add_phone"):
-        _, name, phone = command.split(" ")
-        return controller.do_add_phone(name, phone)
-    elif command.lower().startswith("add_email"):
-        _, line = command.split(" ")
-        return controller.do_add_email(line)
-    elif command.lower().startswith("add_address"):
-        _, line = command.split(" ")
-        return controller.do_add_address(line)
-    elif command.lower().startswith("add_birthday"):
-        _, name, birthday = command.split(" ")
-        return controller.do_add_birthday(name, birthday)
-    elif command.lower().startswith("list_book"):
-        return controller.do_list_book()
-    elif command.lower().startswith("load"):
-        return controller.do_load()
-    elif command.lower().startswith("list_note"):
-         return controller.do_list_note()
-    elif command.lower().startswith("find_info"):
-         _, line = command.split(" ")
-         return controller.do_find(line)
-    elif command.lower().startswith("days_to_birthday"):
-         _, name = command.split(" ")
-         return controller.do_days_to_birthday(name)
-    elif command.lower().startswith("add_note"):
-         _, name = command.split(" ")
-         return controller.do_add_note(name)
-    elif command.lower().startswith("find_note"):
-         _, name = command.split(" ")
-         return controller.do_find_note(name)
-    elif command.lower().startswith("delete_all_notes"):
-         _, name = command.split(" ")
-         return controller.do_delete_all_notes(name)
-    elif command.lower() == "exit":
-         controller.do_exit()
-         return 'Good bye!'
-    elif command.lower() == "save":
-         return controller.do_save()
+    try:
+        return dispatch(controller, command)
+    except CommandError as e:
+        print(e)
+
          
-def main():
+def run_batch(controller, lines, checkpoint=0):
+    # numbered for the error messages; answers to follow-up questions are
+    # lines of the script too
+    lines = enumerate((line.rstrip("\n") for line in lines), 1)
+    controller.input = lambda message="": next(lines, (0, ""))[1]
     controller.do_load()
+    count = 0
+    start = time.perf_counter()
+    try:
+        for number, line in lines:
+            word = line.strip().partition(" ")[0].lower()
+            if not word or word.startswith("#"):
+                continue
+            if word == "exit":
+                break
+            if word == "save":
+                # saves are deferred to the checkpoints and the end of the script
+                continue
+            # a failing command is reported and the script goes on, the
+            # changes made so far are saved either way
+            try:
+                dispatch(controller, line)
+            except CommandError as e:
+                print(f"{number}: {line}: {e}", file=sys.stderr)
+            except Exception as e:
+                print(f"{number}: {line}: {type(e).__name__}: {e}", file=sys.stderr)
+            count += 1
+            if checkpoint and count % checkpoint == 0:
+                controller.book.dump()
+    finally:
+        controller.wait_jobs()
+        controller.book.dump()
+    elapsed = time.perf_counter() - start
+    print(f"Виконано {count} команд за {elapsed:.2f} с ({count / (elapsed or 1e-9):.0f} команд/с)", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Адресна книга")
+    parser.add_argument("--batch", nargs="?", const="-", metavar="FILE",
+                        help="виконати команди з файлу або stdin без інтерактивного режиму")
+    parser.add_argument("--checkpoint", type=int, default=0, metavar="N",
+                        help="зберігати книгу кожні N команд у пакетному режимі")
+    parser.add_argument("--quiet", action="store_true", help="не виводити повідомлення команд")
+    parser.add_argument("--autosave", type=float, default=5.0, metavar="SECONDS",
+                        help="зберігати зміни у фоні не пізніше ніж через SECONDS секунд (0 - вимкнути)")
+    parser.add_argument("--stats", action="store_true", help="збирати статистику команд (команда stats)")
+    parser.add_argument("--book", default="adress_book_1.pkl", metavar="FILE",
+                        help="файл книги; .db, .sqlite або .sqlite3 - книга у SQLite")
+    parser.add_argument("--migrate", metavar="SOURCE",
+                        help="перенести книгу SOURCE (.pkl) у SQLite-книгу --book і вийти")
+    return parser.parse_args(argv)
+
+
+def main(autosave=5.0):
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.history import FileHistory
+    from prompt_toolkit.patch_stdout import patch_stdout
+    controller.do_load()
+    if autosave > 0:
+        controller.start_autosave(autosave)
+    # a big book takes a moment to index; do it before the first Tab
+    threading.Thread(target=controller.book.name_index, daemon=True).start()
+    session = PromptSession(history=FileHistory(str(controller.book.file.with_suffix(".history"))),
+                            completer=command_completer(controller.book), validator=command_validator(),
+                            validate_while_typing=False)
     print("Ласкаво просимо до Адресної Книги")
 
     while True:
-        
-        command_interpreter = NestedCompleter.from_nested_dict({
-                
-                'exit': None,
-                'add_name': None,
-                'add_phone': None,
-                'add_birthday': None,
-                'list_book': None,
-                'load': None,
-                'list_note': None,
-                'find_info': None,
-                'days_to_birthday': None,
-                'add_note': None,
-                'save': None,
-                'find_note': None,
-                'delete_all_notes': None,
-                'add_email': None,
-                'add_address': None,
-                'when': None,
-                'edit_note': None,
-                'sort_files': None,
-                'help': None,
-                })    
-            
-        user_input = prompt('Enter command: ', completer=command_interpreter, validator=CommandValidator(), validate_while_typing=False)
-        if user_input.lower() == "exit":
+        with patch_stdout():
+            user_input = session.prompt('Enter command: ')
+        if handle_command(user_input) is True:
             print("Good bye!")
             break
-        response = handle_command(user_input)
 
 
 if __name__ == "__main__":
-    controller = Controller()
-    main()
+    args = parse_args()
+    metrics.enabled = args.stats
+    if args.migrate:
+        if Path(args.book).suffix.lower() not in SQLITE_SUFFIXES:
+            sys.exit("Для --migrate вкажіть --book з розширенням .db, .sqlite або .sqlite3")
+        print(f"Перенесено контактів: {migrate_book(args.migrate, args.book)}")
+        sys.exit()
+    controller = Controller(open_book(args.book))
+    if args.batch:
+        script = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+        with script, open(os.devnull, "w") if args.quiet else nullcontext(sys.stdout) as out:
+            with redirect_stdout(out):
+                run_batch(controller, script, args.checkpoint)
+    else:
+        main(args.autosave)
    
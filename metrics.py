@@ -0,0 +1,179 @@
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import threading
+import time
+import tracemalloc
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000, float("inf"))
+
+
+class Stat:
+    __slots__ = ("count", "errors", "total", "max", "bytes", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, elapsed, failed=False):
+        ms = elapsed * 1000
+        self.count += 1
+        self.errors += failed
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.buckets[bisect_left(BUCKETS, ms)] += 1
+
+    def percentile(self, fraction):
+        # the histogram only knows the bucket, so this is an upper bound
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Capture:
+    # cProfile or tracemalloc over the next `commands` commands
+    def __init__(self, commands, file, memory=False):
+        self.left = commands
+        self.file = file
+        self.memory = memory
+        if memory:
+            self.profile = None
+        else:
+            import cProfile
+            self.profile = cProfile.Profile()
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def command(self):
+        # one command at a time: the profiler only follows the thread that
+        # enabled it, commands running next to it in the server are skipped
+        if not self.lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            if self.memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+            else:
+                self.profile.enable()
+            try:
+                yield
+            finally:
+                if self.memory:
+                    self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+                else:
+                    self.profile.disable()
+                self.left -= 1
+        finally:
+            self.lock.release()
+
+    def save(self):
+        # runs at the end of whatever command came last, so a failed write is
+        # reported and that command is left alone
+        try:
+            if self.memory:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                with open(self.file, "w", encoding="utf-8") as file:
+                    file.write(f"peak: {self.peak / 1024:.1f} KiB\n")
+                    for line in snapshot.statistics("lineno")[:50]:
+                        file.write(f"{line}\n")
+            else:
+                self.profile.dump_stats(self.file)
+        except OSError as e:
+            print(f"Не вдалося записати профіль у {self.file}: {e}")
+            return False
+        print(f"Профіль записано у {self.file}")
+        return True
+
+
+class Metrics:
+    # everything is a no-op behind one attribute check until enabled
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}
+        self.capture = None
+        self.lock = threading.Lock()
+
+    def _stat(self, name):
+        stat = self.stats.get(name)
+        if stat is None:
+            stat = self.stats.setdefault(name, Stat())
+        return stat
+
+    def record(self, name, elapsed, failed=False):
+        with self.lock:
+            self._stat(name).add(elapsed, failed)
+
+    def add_bytes(self, name, size):
+        if self.enabled:
+            with self.lock:
+                self._stat(name).bytes += size
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def timed(self, name, pages=False):
+        # pages=True times every item pulled from a returned generator,
+        # since that is where the work of a lazy method happens
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                if pages:
+                    return self._timed_items(name, func(*args, **kwargs))
+                with self.measure(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _timed_items(self, name, items):
+        items = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            self.record(name, time.perf_counter() - start)
+            yield item
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.record(name, time.perf_counter() - start, failed)
+
+    def start_capture(self, commands, file, memory=False):
+        self.capture = Capture(commands, file, memory)
+
+    @contextmanager
+    def command(self, name):
+        capture = self.capture
+        if not self.enabled and capture is None:
+            yield
+            return
+        with capture.command() if capture else nullcontext(), self.measure(name) if self.enabled else nullcontext():
+            yield
+        if capture is not None and capture.left <= 0 and self.capture is capture:
+            self.capture = None
+            capture.save()
+
+
+metrics = Metrics()
@@ -0,0 +1,183 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import io
+import json
+import signal
+import sys
+import threading
+
+from main import CommandError, Controller, execute, open_book, parse_command
+
+# commands that make no sense for one client of a shared book, or that would
+# let any client read and write files on the server
+BLOCKED = {"do_load": "Команда load недоступна в режимі сервера",
+           "do_import": "Команда import недоступна в режимі сервера",
+           "do_export": "Команда export недоступна в режимі сервера",
+           "do_sort_files": "Команда sort_files недоступна в режимі сервера"}
+# options that write a file on the server
+BLOCKED_OPTIONS = {"do_dedupe": ("--out",), "do_stats": ("--profile", "--memory", "--out")}
+
+
+class CapturingStdout:
+    # commands print their results; each worker thread gets its own buffer
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        return (getattr(self.local, "buffer", None) or self.stream).write(text)
+
+    def flush(self):
+        (getattr(self.local, "buffer", None) or self.stream).flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @contextmanager
+    def capture(self):
+        self.local.buffer = io.StringIO()
+        try:
+            yield self.local.buffer
+        finally:
+            self.local.buffer = None
+
+
+class BookServer:
+    def __init__(self, controller, workers=8):
+        self.controller = controller
+        self.pool = ThreadPoolExecutor(workers)
+        self.locks = {}
+        if not isinstance(sys.stdout, CapturingStdout):
+            sys.stdout = CapturingStdout(sys.stdout)
+        self.stdout = sys.stdout
+
+    @asynccontextmanager
+    async def record_lock(self, name):
+        # requests for the same contact run one after another, different
+        # contacts go to the worker threads side by side
+        if name is None:
+            yield
+            return
+        lock, users = self.locks.get(name, (None, 0))
+        lock = lock or asyncio.Lock()
+        self.locks[name] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self.locks[name]
+            if users == 1:
+                del self.locks[name]
+            else:
+                self.locks[name] = (lock, users - 1)
+
+    def run(self, command, args, answers):
+        controller = Controller(self.controller.book)
+        answers = iter(answers)
+        controller.input = lambda message="": next(answers, "")
+        controller.autosaver = self.controller.autosaver
+        with self.stdout.capture() as buffer:
+            execute(controller, command, args)
+        return buffer.getvalue()
+
+    async def execute(self, request):
+        text = request.get("command", "")
+        try:
+            parsed = parse_command(text)
+        except CommandError as e:
+            return {"ok": False, "error": str(e)}
+        if parsed is None:
+            return {"ok": True, "output": ""}
+        command, args = parsed
+        if command.method in BLOCKED:
+            return {"ok": False, "error": BLOCKED[command.method]}
+        blocked = [word for word in " ".join(args).split() if word in BLOCKED_OPTIONS.get(command.method, ())]
+        if blocked:
+            return {"ok": False, "error": f"Параметр {blocked[0]} недоступний в режимі сервера"}
+        answers = request.get("input") or []
+        if not isinstance(answers, list) or not all(isinstance(answer, str) for answer in answers):
+            return {"ok": False, "error": 'Поле "input" повинно бути списком рядків'}
+        if "name" in command.args:
+            name = args[command.args.index("name")].title()
+        elif command.method == "do_add_name" and answers:
+            name = answers[0].strip().title()
+        else:
+            name = None
+        async with self.record_lock(name):
+            output = await asyncio.get_running_loop().run_in_executor(self.pool, self.run, command, args, answers)
+        return {"ok": True, "output": output}
+
+    async def handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    request = {"command": line.decode(errors="replace").strip()}
+                if not isinstance(request, dict) or not isinstance(request.get("command", ""), str):
+                    response = {"ok": False, "error": 'Запит повинен бути JSON-об\'єктом з рядком "command"'}
+                elif request.get("command", "").strip().lower() == "exit":
+                    break
+                else:
+                    # a failing command is this request's error, the
+                    # connection and the other clients carry on
+                    try:
+                        response = await self.execute(request)
+                    except Exception as e:
+                        response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                    if "id" in request:
+                        response["id"] = request["id"]
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765, socket_path=None):
+        if socket_path:
+            return await asyncio.start_unix_server(self.handle, socket_path)
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(args):
+    controller = Controller(open_book(args.book))
+    controller.do_load()
+    controller.start_autosave(args.autosave)
+    server = BookServer(controller, args.workers)
+    listener = await server.start(args.host, args.port, args.socket)
+    print(f"Сервер адресної книги слухає {args.socket or f'{args.host}:{args.port}'}")
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        controller.do_exit()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сервер адресної книги (JSON lines)")
+    parser.add_argument("--book", default="adress_book_1.pkl")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", metavar="PATH", help="слухати Unix-сокет замість TCP")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--autosave", type=float, default=1.0, metavar="SECONDS")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,197 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import sys
+import threading
+
+from indexes import TRANSLIT
+
+CATEGORIES = {
+    "images": (".jpeg", ".png", ".jpg", ".svg", ".gif", ".bmp", ".webp"),
+    "video": (".avi", ".mp4", ".mov", ".mkv"),
+    "documents": (".doc", ".docx", ".txt", ".pdf", ".xlsx", ".pptx", ".odt", ".csv"),
+    "audio": (".mp3", ".ogg", ".wav", ".amr", ".flac"),
+    "archives": (".zip", ".gz", ".tar", ".tgz", ".bz2", ".xz"),
+}
+EXTENSIONS = {ext: category for category, extensions in CATEGORIES.items() for ext in extensions}
+MANIFEST = ".sort_manifest.json"
+
+
+
+def normalize(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name.translate(TRANSLIT))
+
+
+def extract(archive, target):
+    # runs in a worker process: unpacking is CPU bound
+    try:
+        shutil.unpack_archive(archive, target)
+    except (shutil.ReadError, ValueError, OSError):
+        shutil.rmtree(target, ignore_errors=True)
+        return archive, False
+    return archive, True
+
+
+def walk(root, skip=(), onerror=None):
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = os.scandir(folder)
+        except OSError as e:
+            if onerror:
+                onerror(folder, e)
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in skip:
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and entry.name != MANIFEST:
+                    yield entry
+
+
+class Sorter:
+    def __init__(self, root, workers=None, progress=None):
+        self.root = Path(root).resolve()
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.progress = progress
+        self.manifest_file = self.root / MANIFEST
+        self.manifest = {}
+        self.updated = {}
+        self.lock = threading.Lock()
+        self.reserved = set()
+        self.pool = None
+        self.stats = {"moved": 0, "skipped": 0, "unknown": 0, "extracted": 0, "failed": 0}
+        self.errors = []
+
+    def load_manifest(self):
+        try:
+            self.manifest = json.loads(self.manifest_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def save_manifest(self):
+        tmp = self.manifest_file.with_name(MANIFEST + ".tmp")
+        # only files seen in this run are kept, so moved or deleted ones drop out
+        tmp.write_text(json.dumps(self.updated), encoding="utf-8")
+        os.replace(tmp, self.manifest_file)
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+            done = sum(self.stats.values())
+        if self.progress and done % 500 == 0:
+            self.progress(dict(self.stats))
+
+    def _failed(self, path, error):
+        # one file that can't be read or moved doesn't stop the others
+        with self.lock:
+            self.errors.append((str(path), error))
+        print(f"[sort_files] {path}: {error}", file=sys.stderr)
+        self._count("failed")
+
+    def _remember(self, path, stat):
+        with self.lock:
+            self.updated[str(Path(path).relative_to(self.root))] = [stat.st_size, stat.st_mtime_ns]
+
+    def _archives_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor()
+            return self.pool
+
+    def _destination(self, category, path):
+        stem, ext = os.path.splitext(path.name)
+        folder = self.root / category
+        folder.mkdir(exist_ok=True)
+        with self.lock:
+            target = folder / (normalize(stem) + ext.lower())
+            if target == path:
+                return target
+            number = 1
+            while target in self.reserved or target.exists():
+                target = folder / f"{normalize(stem)}_{number}{ext.lower()}"
+                number += 1
+            self.reserved.add(target)
+        return target
+
+    def handle(self, entry, archives):
+        stat = entry.stat(follow_symlinks=False)
+        rel = str(Path(entry.path).relative_to(self.root))
+        if self.manifest.get(rel) == [stat.st_size, stat.st_mtime_ns]:
+            self._remember(entry.path, stat)
+            self._count("skipped")
+            return
+        category = EXTENSIONS.get(os.path.splitext(entry.name)[1].lower())
+        if category is None:
+            self._remember(entry.path, stat)
+            self._count("unknown")
+            return
+        path = Path(entry.path)
+        target = self._destination(category, path)
+        if target == path:
+            self._remember(target, stat)
+            self._count("skipped")
+            return
+        try:
+            shutil.move(path, target)
+        except OSError:
+            # a move across devices copies first; a copy whose source could
+            # not be deleted is dropped, the file stays where it was
+            if path.exists():
+                target.unlink(missing_ok=True)
+            raise
+        self._remember(target, target.stat())
+        if category == "archives":
+            folder = target.with_name(target.name.split(".")[0])
+            archives.append(self._archives_pool().submit(extract, str(target), str(folder)))
+        self._count("moved")
+
+    def remove_empty(self):
+        keep = {str(self.root / category) for category in CATEGORIES}
+        for folder, _, _ in sorted(os.walk(self.root), key=lambda item: -len(item[0])):
+            if folder not in keep and Path(folder) != self.root:
+                try:
+                    if not os.listdir(folder):
+                        os.rmdir(folder)
+                except OSError as e:
+                    self.errors.append((folder, e))
+
+    def run(self):
+        if not self.root.is_dir():
+            raise FileNotFoundError(self.root)
+        self.load_manifest()
+        # unpacked archives are left as they are; everything else, sorted
+        # folders included, is walked and skipped by the manifest if unchanged
+        skip = {str(self.root / "archives")}
+        archives = []
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                futures = [(entry.path, pool.submit(self.handle, entry, archives))
+                           for entry in walk(str(self.root), skip, self._failed)]
+                for path, future in futures:
+                    try:
+                        future.result()
+                    except OSError as e:
+                        self._failed(path, e)
+            for future in archives:
+                _, ok = future.result()
+                self._count("extracted" if ok else "failed")
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.save_manifest()
+        self.remove_empty()
+        return self.stats
+
+
+def run(folder, workers=None, progress=None):
+    return Sorter(folder, workers, progress).run()
+
+
+if __name__ == "__main__":
+    print(run(sys.argv[1]))
@@ -0,0 +1,393 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+from datetime import date
+import sqlite3
+
+from indexes import QUERY_RE, TagIndex, normalize_phone, tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    folded TEXT NOT NULL,
+    email TEXT,
+    email_key TEXT,
+    address TEXT,
+    birthday TEXT,
+    birth_md TEXT
+);
+CREATE INDEX IF NOT EXISTS contacts_folded ON contacts(folded);
+CREATE INDEX IF NOT EXISTS contacts_email ON contacts(email_key);
+CREATE INDEX IF NOT EXISTS contacts_birth_md ON contacts(birth_md);
+CREATE TABLE IF NOT EXISTS phones (
+    contact_id INTEGER NOT NULL REFERENCES contacts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    phone TEXT NOT NULL,
+    PRIMARY KEY (contact_id, position)
+);
+CREATE INDEX IF NOT EXISTS phones_phone ON phones(phone);
+CREATE TABLE IF NOT EXISTS address_words (
+    contact_id INTEGER NOT NULL REFERENCES contacts(id) ON DELETE CASCADE,
+    word TEXT NOT NULL,
+    PRIMARY KEY (word, contact_id)
+);
+CREATE INDEX IF NOT EXISTS address_words_contact ON address_words(contact_id);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    contact_id INTEGER NOT NULL REFERENCES contacts(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_contact ON notes(contact_id, position);
+CREATE INDEX IF NOT EXISTS notes_date ON notes(date);
+CREATE TABLE IF NOT EXISTS note_tags (
+    note_id INTEGER NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (tag, note_id)
+);
+CREATE INDEX IF NOT EXISTS note_tags_note ON note_tags(note_id);
+"""
+# optional: not every sqlite build has FTS5; note search then falls back to LIKE
+FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(text)"
+COLUMNS = "c.id, c.name, c.email, c.address, c.birthday"
+PAGE = 1000
+
+
+class SqlStore:
+    # contacts as plain rows (the exchange.FIELDS layout) in one sqlite file;
+    # nothing is pickled, so other tools and processes can read it
+    def __init__(self, file):
+        self.file = str(file)
+        # the book lock serializes access, the server calls in from workers
+        self.db = sqlite3.connect(self.file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.execute(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def checkpoint(self):
+        self.db.commit()
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.execute("PRAGMA optimize")
+
+    def count(self):
+        return self.db.execute("SELECT count(*) FROM contacts").fetchone()[0]
+
+    def contains(self, name):
+        return self.db.execute("SELECT 1 FROM contacts WHERE name = ?", (name,)).fetchone() is not None
+
+    def names(self, after=0):
+        # a page at a time, so writes can go in between
+        while True:
+            page = self.db.execute("SELECT id, name FROM contacts WHERE id > ? ORDER BY id LIMIT ?",
+                                   (after, PAGE)).fetchall()
+            if not page:
+                return
+            after = page[-1][0]
+            yield [name for _, name in page]
+
+    def _rows(self, contacts):
+        if not contacts:
+            return []
+        ids = [contact[0] for contact in contacts]
+        marks = ",".join("?" * len(ids))
+        phones, notes = {}, {}
+        for contact_id, phone in self.db.execute(
+                f"SELECT contact_id, phone FROM phones WHERE contact_id IN ({marks}) ORDER BY contact_id, position", ids):
+            phones.setdefault(contact_id, []).append(phone)
+        tags = {}
+        for note_id, tag in self.db.execute(
+                f"SELECT t.note_id, t.tag FROM note_tags t JOIN notes n ON n.id = t.note_id "
+                f"WHERE n.contact_id IN ({marks})", ids):
+            tags.setdefault(note_id, []).append(tag)
+        for note_id, contact_id, text, when in self.db.execute(
+                f"SELECT id, contact_id, text, date FROM notes WHERE contact_id IN ({marks}) "
+                f"ORDER BY contact_id, position", ids):
+            notes.setdefault(contact_id, []).append({"text": text, "tags": sorted(tags.get(note_id, ())), "date": when})
+        return [{"name": name, "phones": phones.get(contact_id, []), "email": email, "address": address,
+                 "birthday": birthday, "notes": notes.get(contact_id, [])}
+                for contact_id, name, email, address, birthday in contacts]
+
+    def get(self, name):
+        rows = self._rows(self.db.execute(f"SELECT {COLUMNS} FROM contacts c WHERE c.name = ?", (name,)).fetchall())
+        return rows[0] if rows else None
+
+    def get_many(self, names):
+        found = {}
+        names = list(names)
+        for i in range(0, len(names), PAGE):
+            chunk = names[i:i + PAGE]
+            contacts = self.db.execute(
+                f"SELECT {COLUMNS} FROM contacts c WHERE c.name IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for row in self._rows(contacts):
+                found[row["name"]] = row
+        return found
+
+    def page(self, after=0, size=PAGE, offset=0):
+        # returns the rows and the id to continue after
+        contacts = self.db.execute(f"SELECT {COLUMNS} FROM contacts c WHERE c.id > ? ORDER BY c.id LIMIT ? OFFSET ?",
+                                   (after, size, offset)).fetchall()
+        return self._rows(contacts), contacts[-1][0] if contacts else None
+
+    def save(self, row):
+        born = row["birthday"] or None
+        # 2000-1-5 is a valid birthday too, the index needs it as 01-05
+        birth_md = "{1:0>2}-{2:0>2}".format(*born.split("-")) if born else None
+        values = (row["name"].casefold(), row["email"] or None, row["email"].casefold() if row["email"] else None,
+                  row["address"] or None, born, birth_md, row["name"])
+        found = self.db.execute("SELECT id FROM contacts WHERE name = ?", (row["name"],)).fetchone()
+        if found is None:
+            contact_id = self.db.execute(
+                "INSERT INTO contacts (folded, email, email_key, address, birthday, birth_md, name) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", values).lastrowid
+        else:
+            contact_id = found[0]
+            self.db.execute("UPDATE contacts SET folded = ?, email = ?, email_key = ?, address = ?, birthday = ?, "
+                            "birth_md = ? WHERE name = ?", values)
+            self._clear(contact_id)
+        self.db.executemany("INSERT INTO phones (contact_id, position, phone) VALUES (?, ?, ?)",
+                            [(contact_id, i, phone) for i, phone in enumerate(row["phones"])])
+        self.db.executemany("INSERT OR IGNORE INTO address_words (contact_id, word) VALUES (?, ?)",
+                            [(contact_id, word) for word in tokenize(row["address"] or "")])
+        for i, note in enumerate(row["notes"]):
+            note_id = self.db.execute("INSERT INTO notes (contact_id, position, text, date) VALUES (?, ?, ?, ?)",
+                                      (contact_id, i, note["text"], note["date"])).lastrowid
+            self.db.executemany("INSERT OR IGNORE INTO note_tags (note_id, tag) VALUES (?, ?)",
+                                [(note_id, tag) for tag in note["tags"]])
+            if self.fts:
+                self.db.execute("INSERT INTO notes_fts (rowid, text) VALUES (?, ?)", (note_id, note["text"]))
+
+    def _clear(self, contact_id):
+        if self.fts:
+            self.db.execute("DELETE FROM notes_fts WHERE rowid IN (SELECT id FROM notes WHERE contact_id = ?)",
+                            (contact_id,))
+        self.db.execute("DELETE FROM notes WHERE contact_id = ?", (contact_id,))
+        self.db.execute("DELETE FROM phones WHERE contact_id = ?", (contact_id,))
+        self.db.execute("DELETE FROM address_words WHERE contact_id = ?", (contact_id,))
+
+    def delete(self, name):
+        found = self.db.execute("SELECT id FROM contacts WHERE name = ?", (name,)).fetchone()
+        if found is not None:
+            self._clear(found[0])
+            self.db.execute("DELETE FROM contacts WHERE id = ?", found)
+
+    def search(self, term):
+        # the same ranking as indexes.SearchIndex: exact, word prefix, substring
+        folded = term.casefold()
+        query = ("SELECT name, CASE WHEN folded = :term THEN 0 "
+                 "WHEN instr(' ' || folded, ' ' || :term) > 0 THEN 1 ELSE 2 END AS rank "
+                 "FROM contacts WHERE instr(folded, :term) > 0")
+        if term.isdigit():
+            query += (" UNION ALL SELECT c.name, CASE WHEN p.phone = :term THEN 0 WHEN instr(p.phone, :term) = 1 "
+                      "THEN 1 ELSE 2 END FROM phones p JOIN contacts c ON c.id = p.contact_id "
+                      "WHERE instr(p.phone, :term) > 0")
+        return [name for name, _ in self.db.execute(
+            f"SELECT name, min(rank) AS best FROM ({query}) GROUP BY name ORDER BY best, name",
+            {"term": folded})]
+
+    def birthday(self, name):
+        found = self.db.execute("SELECT birthday FROM contacts WHERE name = ?", (name,)).fetchone()
+        return found[0] if found else None
+
+    def birthdays_between(self, start, end):
+        # month-day ranges over the birth_md index; a window across new year
+        # is two ranges. Feb 29 birthdays are picked up with Feb 28
+        if (end - start).days >= 365:
+            query, args = "birth_md IS NOT NULL", ()
+        else:
+            first, last = start.strftime("%m-%d"), end.strftime("%m-%d")
+            if last == "02-28":
+                last = "02-29"
+            if start.year == end.year:
+                query, args = "birth_md BETWEEN ? AND ?", (first, last)
+            else:
+                query, args = "(birth_md >= ? OR birth_md <= ?)", (first, last)
+        return self.db.execute(f"SELECT name, birthday FROM contacts WHERE {query}", args).fetchall()
+
+    def columns(self):
+        # what AddressBook.columns() returns, counted by sqlite
+        names, birthdays, phones, notes = [], [], [], []
+        for name, born, phone_count, note_count in self.db.execute(
+                "SELECT c.name, substr(c.birthday, 1, 4) || '-' || c.birth_md, "
+                "(SELECT count(*) FROM phones p WHERE p.contact_id = c.id), "
+                "(SELECT count(*) FROM notes n WHERE n.contact_id = c.id) FROM contacts c ORDER BY c.id"):
+            names.append(name)
+            birthdays.append(date.fromisoformat(born) if born else None)
+            phones.append(phone_count)
+            notes.append(note_count)
+        tags = dict(self.db.execute("SELECT tag, count(*) FROM note_tags GROUP BY tag"))
+        return names, birthdays, phones, notes, tags
+
+    def by_phone(self, phone):
+        return [name for (name,) in self.db.execute(
+            "SELECT DISTINCT c.name FROM phones p JOIN contacts c ON c.id = p.contact_id WHERE p.phone = ? "
+            "ORDER BY c.name", (normalize_phone(phone),))]
+
+    def by_email(self, email):
+        return [name for (name,) in self.db.execute(
+            "SELECT name FROM contacts WHERE email_key = ? ORDER BY name", (email.strip().casefold(),))]
+
+    def by_address(self, address):
+        words = sorted(set(tokenize(address)))
+        if not words:
+            return []
+        return [name for (name,) in self.db.execute(
+            f"SELECT c.name FROM address_words w JOIN contacts c ON c.id = w.contact_id "
+            f"WHERE w.word IN ({','.join('?' * len(words))}) GROUP BY c.id HAVING count(*) = ? ORDER BY c.name",
+            (*words, len(words)))]
+
+    def notes_by_tags(self, expression, start=None, end=None, offset=0, limit=None):
+        # TagIndex's query language: "a b OR c -d" is (a AND b) OR (c AND NOT d)
+        clauses, args = [], []
+        for include, exclude in TagIndex().parse_query(expression or ""):
+            parts = []
+            if include:
+                parts.append(f"n.id IN (SELECT note_id FROM note_tags WHERE tag IN ({','.join('?' * len(include))}) "
+                             f"GROUP BY note_id HAVING count(*) = ?)")
+                args += [*sorted(set(include)), len(set(include))]
+            if exclude:
+                parts.append(f"n.id NOT IN (SELECT note_id FROM note_tags WHERE tag IN ({','.join('?' * len(exclude))}))")
+                args += exclude
+            clauses.append("(" + " AND ".join(parts) + ")")
+        where = ["(" + " OR ".join(clauses) + ")"] if clauses else []
+        if expression and not clauses:
+            return 0, []
+        if start:
+            where.append("n.date >= ?")
+            args.append(start)
+        if end:
+            where.append("substr(n.date, 1, length(?)) <= ?")
+            args += [end, end]
+        condition = " WHERE " + " AND ".join(where) if where else ""
+        total = self.db.execute(f"SELECT count(*) FROM notes n{condition}", args).fetchone()[0]
+        found = self.db.execute(
+            f"SELECT c.name, n.position FROM notes n JOIN contacts c ON c.id = n.contact_id{condition} "
+            f"ORDER BY n.date LIMIT ? OFFSET ?", (*args, -1 if limit is None else limit, offset)).fetchall()
+        return total, found
+
+    def search_notes(self, query, offset=0, limit=10):
+        if self.fts:
+            match = []
+            for phrase, word in QUERY_RE.findall(query):
+                text = phrase or word.rstrip("*")
+                if tokenize(text):
+                    quoted = '"' + text.replace('"', '""') + '"'
+                    match.append(quoted + "*" if not phrase and word.endswith("*") else quoted)
+            if not match:
+                return 0, []
+            match = " ".join(match)
+            total = self.db.execute("SELECT count(*) FROM notes_fts WHERE notes_fts MATCH ?", (match,)).fetchone()[0]
+            # bm25() is lower for better matches
+            found = self.db.execute(
+                "SELECT c.name, n.position, -bm25(notes_fts) AS score FROM notes_fts "
+                "JOIN notes n ON n.id = notes_fts.rowid JOIN contacts c ON c.id = n.contact_id "
+                "WHERE notes_fts MATCH ? ORDER BY score DESC LIMIT ? OFFSET ?", (match, limit, offset)).fetchall()
+            return total, found
+        words = tokenize(query)
+        if not words:
+            return 0, []
+        condition = " AND ".join("instr(lower(n.text), ?) > 0" for _ in words)
+        total = self.db.execute(f"SELECT count(*) FROM notes n WHERE {condition}", words).fetchone()[0]
+        found = self.db.execute(
+            f"SELECT c.name, n.position, 0.0 FROM notes n JOIN contacts c ON c.id = n.contact_id WHERE {condition} "
+            f"ORDER BY n.date LIMIT ? OFFSET ?", (*words, limit, offset)).fetchall()
+        return total, found
+
+
+class SqlRecords(MutableMapping):
+    # the book's `data` on top of SqlStore; records handed out stay in an LRU
+    # so the same contact is the same object while it is being edited
+    def __init__(self, store, to_record, to_row, cache_size=10000, lock=None):
+        self.store = store
+        # taken for every page read by a generator, which runs outside the
+        # book method that started it
+        self.lock = lock or nullcontext()
+        self.to_record = to_record
+        self.to_row = to_row
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def _remember(self, name, record):
+        self.cache[name] = record
+        self.cache.move_to_end(name)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return record
+
+    def __contains__(self, name):
+        return name in self.cache or self.store.contains(name)
+
+    def __getitem__(self, name):
+        record = self.cache.get(name)
+        if record is not None:
+            self.cache.move_to_end(name)
+            return record
+        row = self.store.get(name)
+        if row is None:
+            raise KeyError(name)
+        return self._remember(name, self.to_record(row))
+
+    def __setitem__(self, name, record):
+        self.store.save(self.to_row(record))
+        self._remember(name, record)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.cache.pop(name, None)
+        self.store.delete(name)
+
+    def __iter__(self):
+        for names in self.store.names():
+            yield from names
+
+    def __len__(self):
+        return self.store.count()
+
+    def records(self, rows):
+        for row in rows:
+            record = self.cache.get(row["name"])
+            yield row["name"], record if record is not None else self.to_record(row)
+
+    def many(self, names):
+        # one round of queries for a whole result list instead of one per name
+        names = list(names)
+        rows = self.store.get_many(name for name in names if name not in self.cache)
+        return [self[name] if name not in rows else self._remember(name, self.to_record(rows[name]))
+                for name in names]
+
+    def items(self, offset=0):
+        # the first `offset` contacts are skipped by sqlite, not loaded
+        after = 0
+        while True:
+            with self.lock:
+                rows, after = self.store.page(after, offset=offset)
+                found = list(self.records(rows))
+            if after is None:
+                return
+            offset = 0
+            yield from found
+
+    def values(self, offset=0):
+        for _, record in self.items(offset):
+            yield record
+
+    def clear_cache(self):
+        self.cache.clear()
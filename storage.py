@@ -0,0 +1,516 @@
+from array import array
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from copy import copy
+import hashlib
+import mmap
+import os
+import pickle
+from pathlib import Path
+import struct
+import tempfile
+import threading
+
+# snapshot layout: MAGIC, HEADER, record blobs, hash table, pickled indexes
+# record blob: <I name length> name <I payload length> pickled record
+# hash table: (name hash, blob offset) pairs sorted by hash
+MAGIC = b"ABOOK\x01\n\x00"
+HEADER = struct.Struct("<qqQQQQ")
+LENGTH = struct.Struct("<I")
+ENTRY = struct.Struct("<QQ")
+
+
+def name_hash(name):
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "little")
+
+
+def is_snapshot(file):
+    with open(file, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_snapshot(file, items, record_id, seq, indexes):
+    file = Path(file)
+    tmp = file.with_name(file.name + ".tmp")
+    entries = []
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + bytes(HEADER.size))
+        for name, record in items:
+            offset = f.tell()
+            key = name.encode()
+            # untouched records are copied over as the bytes they were read as
+            payload = record if isinstance(record, bytes) else pickle.dumps(record)
+            f.write(LENGTH.pack(len(key)) + key + LENGTH.pack(len(payload)) + payload)
+            entries.append((name_hash(name), offset))
+        entries.sort()
+        table_offset = f.tell()
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+        meta_offset = f.tell()
+        meta = indexes if isinstance(indexes, bytes) else pickle.dumps(indexes)
+        f.write(meta)
+        f.seek(len(MAGIC))
+        f.write(HEADER.pack(record_id, seq, len(entries), table_offset, meta_offset, len(meta)))
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
+
+class RecordStore:
+    def __init__(self, file):
+        self.file = Path(file)
+        self._fd = open(self.file, "rb")
+        self.map = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+        (self.record_id, self.seq, self.count, self.table_offset,
+         self.meta_offset, self.meta_length) = HEADER.unpack_from(self.map, len(MAGIC))
+        self.positions = None
+
+    def close(self):
+        self.map.close()
+        self._fd.close()
+
+    def _name_at(self, offset):
+        (length,) = LENGTH.unpack_from(self.map, offset)
+        start = offset + LENGTH.size
+        return self.map[start:start + length].decode(), start + length
+
+    def _hash_at(self, i):
+        return ENTRY.unpack_from(self.map, self.table_offset + i * ENTRY.size)
+
+    def find(self, name):
+        target = name_hash(name)
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._hash_at(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.count:
+            value, offset = self._hash_at(lo)
+            if value != target:
+                break
+            stored, end = self._name_at(offset)
+            if stored == name:
+                return end
+            lo += 1
+        return None
+
+    def get(self, name):
+        end = self.find(name)
+        if end is None:
+            raise KeyError(name)
+        (length,) = LENGTH.unpack_from(self.map, end)
+        start = end + LENGTH.size
+        return pickle.loads(self.map[start:start + length])
+
+    def names(self):
+        offset = len(MAGIC) + HEADER.size
+        while offset < self.table_offset:
+            name, end = self._name_at(offset)
+            (length,) = LENGTH.unpack_from(self.map, end)
+            offset = end + LENGTH.size + length
+            yield name
+
+    def _positions(self):
+        # blob offsets in file order, from the hash table; read once, for
+        # jumping to the n-th record
+        if self.positions is None:
+            table = self.map[self.table_offset:self.table_offset + self.count * ENTRY.size]
+            self.positions = array("Q", sorted(offset for _, offset in ENTRY.iter_unpack(table)))
+        return self.positions
+
+    def blobs(self, start=0):
+        # from the `start`-th record on
+        if start >= self.count:
+            return
+        offset = self._positions()[start] if start else len(MAGIC) + HEADER.size
+        while offset < self.table_offset:
+            name, end = self._name_at(offset)
+            (length,) = LENGTH.unpack_from(self.map, end)
+            offset = end + LENGTH.size + length
+            yield name, self.map[end + LENGTH.size:offset]
+
+    def indexes(self):
+        if not self.meta_length:
+            return None
+        return pickle.loads(self.map[self.meta_offset:self.meta_offset + self.meta_length])
+
+
+class Segment:
+    # records moved out of memory by a bulk import until the next compaction
+    # writes them: an unnamed temporary file next to the book that is only
+    # appended to, so a blob read once stays valid while it is open
+    def __init__(self, directory):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.offsets = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        self.file.close()
+
+    def put(self, items):
+        # one write for the lot; an append costs what it writes, whatever
+        # the size of the book
+        chunks = []
+        offsets = {}
+        with self.lock:
+            offset = self.file.seek(0, os.SEEK_END)
+            for name, record in items:
+                payload = pickle.dumps(record)
+                offsets[name] = (offset, len(payload))
+                chunks.append(payload)
+                offset += len(payload)
+            self.file.write(b"".join(chunks))
+            self.file.flush()
+        self.offsets.update(offsets)
+
+    def blob(self, name):
+        place = self.offsets.get(name)
+        if place is None:
+            return None
+        with self.lock:
+            self.file.seek(place[0])
+            return self.file.read(place[1])
+
+    def discard(self, name):
+        self.offsets.pop(name, None)
+
+
+class LazyRecords(MutableMapping):
+    # records stay in the snapshot until touched; clean ones live in a
+    # bounded LRU, changed ones are pinned in dirty until the next compaction,
+    # or in the segment once a bulk import has spilled them there
+    def __init__(self, store=None, cache_size=10000, loaded=None):
+        self.store = store
+        self.cache_size = cache_size
+        self.loaded = loaded
+        self.cache = OrderedDict()
+        self.dirty = {}
+        self.added = {}
+        self.deleted = set()
+        self.segment = None
+        self.length = store.count if store else 0
+
+    def _in_store(self, name):
+        return self.store is not None and name not in self.deleted and self.store.find(name) is not None
+
+    def __contains__(self, name):
+        return (name in self.dirty or name in self.cache
+                or (self.segment is not None and name in self.segment) or self._in_store(name))
+
+    def __getitem__(self, name):
+        record = self.dirty.get(name)
+        if record is not None:
+            return record
+        record = self.cache.get(name)
+        if record is not None:
+            self.cache.move_to_end(name)
+            return record
+        payload = self.spilled(name)
+        if payload is not None:
+            record = pickle.loads(payload)
+        elif self.store is None or name in self.deleted:
+            raise KeyError(name)
+        else:
+            record = self.store.get(name)
+        if self.loaded:
+            self.loaded(record)
+        self.cache[name] = record
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return record
+
+    def __setitem__(self, name, record):
+        if name not in self:
+            self.length += 1
+            if self.store is None or self.store.find(name) is None:
+                self.added[name] = None
+        self.deleted.discard(name)
+        self.cache.pop(name, None)
+        self.dirty[name] = record
+        if self.segment is not None:
+            self.segment.discard(name)
+
+    def touch(self, name, record):
+        self.cache.pop(name, None)
+        self.dirty[name] = record
+        if self.segment is not None:
+            self.segment.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.dirty.pop(name, None)
+        self.cache.pop(name, None)
+        if self.segment is not None:
+            self.segment.discard(name)
+        if name in self.added:
+            del self.added[name]
+        elif self.store is not None:
+            self.deleted.add(name)
+        self.length -= 1
+
+    def __iter__(self):
+        if self.store is not None:
+            for name in self.store.names():
+                if name not in self.deleted:
+                    yield name
+        yield from list(self.added)
+
+    def __len__(self):
+        return self.length
+
+    def items(self, raw=False):
+        # a sequential pass over the file; unlike lookups it doesn't go
+        # through the hash table or push the hot records out of the cache
+        if self.store is not None:
+            for name, payload in self.store.blobs():
+                if name in self.deleted:
+                    continue
+                yield name, self._item(name, payload, raw)
+        for name in list(self.added):
+            yield name, self._item(name, None, raw)
+
+    def _item(self, name, payload, raw):
+        record = self.dirty.get(name) or self.cache.get(name)
+        if record is not None:
+            return record
+        payload = self.spilled(name) or payload
+        if raw:
+            return payload
+        record = pickle.loads(payload)
+        if self.loaded:
+            self.loaded(record)
+        return record
+
+    def values(self):
+        for _, record in self.items():
+            yield record
+
+    def changed(self):
+        spilled = set(self.segment.offsets) if self.segment is not None else set()
+        return set(self.dirty) | spilled | self.deleted
+
+    def spilled(self, name):
+        # the pickled record if a bulk import moved it to the segment
+        return self.segment.blob(name) if self.segment is not None else None
+
+    def spill(self, directory):
+        # the changed records go to the segment, so they no longer take
+        # memory; written first and dropped from dirty after, so a reader
+        # finds each of them in one place or the other
+        if not self.dirty:
+            return
+        if self.segment is None:
+            self.segment = Segment(directory)
+        spilled = list(self.dirty.items())
+        self.segment.put(spilled)
+        for name, record in spilled:
+            if self.dirty.get(name) is record:
+                del self.dirty[name]
+
+
+class Snapshot:
+    # LazyRecords as they were at one moment, without copying them: the first
+    # change to a record afterwards hands its old version to every open
+    # snapshot (preserve), and those versions go away with the snapshot.
+    # This works because records are never edited in place, a change puts
+    # new lists and fields into the record, so a shallow copy is a version
+    def __init__(self, records, seq=0, record_id=0):
+        self.records = records
+        self.store = records.store
+        self.added = list(records.added)
+        self.deleted = set(records.deleted)
+        self.seq = seq
+        self.record_id = record_id
+        # name -> old version, None for a name that didn't exist yet
+        self.versions = {}
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.closed = True
+        self.versions = {}
+
+    def _had(self, name):
+        if name in self.deleted:
+            return False
+        return name in self.added or (self.store is not None and self.store.find(name) is not None)
+
+    def preserve(self, name, record):
+        # called under the book lock, before `record` changes
+        if self.closed or name in self.versions:
+            return
+        self.versions[name] = copy(record) if self._had(name) else None
+
+    def _read(self, name, payload, raw):
+        versions = self.versions
+        if name not in versions:
+            record = self.records.dirty.get(name) or self.records.cache.get(name)
+            if record is None:
+                spilled = self.records.spilled(name)
+                if spilled is not None or name not in versions:
+                    # untouched since it was written, the bytes are the version
+                    payload = spilled or payload
+                    return payload if raw else pickle.loads(payload)
+                # taken out of the segment by a change that has just handed
+                # over the old version
+                value = None
+            else:
+                value = pickle.dumps(record) if raw else copy(record)
+            # a change that started while the record was being read has
+            # handed over the old version by now
+            if name not in versions:
+                return value
+        version = versions[name]
+        return pickle.dumps(version) if raw else version
+
+    def items(self, raw=False, start=0):
+        # detached copies (or pickled bytes), in the order of LazyRecords.items;
+        # the first `start` are skipped without being read
+        if self.store is not None:
+            blobs = self.store.blobs()
+            if start and not self.deleted:
+                blobs = self.store.blobs(start)
+                start = max(start - self.store.count, 0)
+            for name, payload in blobs:
+                if name in self.deleted:
+                    continue
+                if start:
+                    start -= 1
+                    continue
+                yield name, self._read(name, payload, raw)
+        for name in self.added[start:]:
+            yield name, self._read(name, None, raw)
+
+    def values(self, start=0):
+        for _, record in self.items(start=start):
+            yield record
+
+
+class Journal:
+    def __init__(self, file):
+        self.file = Path(file)
+        self.pending = []
+        self.size = 0
+
+    def append(self, entry):
+        # entry is pickled right away so later edits of the same record
+        # don't leak into an earlier journal entry
+        self.pending.append(pickle.dumps(entry))
+
+    def flush(self):
+        if not self.pending:
+            return 0
+        data = memoryview(b"".join(self.pending))
+        written = 0
+        # unbuffered, so nothing is left in a buffer to be written after
+        # the truncate below
+        with open(self.file, "ab", buffering=0) as file:
+            start = file.seek(0, os.SEEK_END)
+            try:
+                while written < len(data):
+                    written += file.write(data[written:])
+                os.fsync(file.fileno())
+            except BaseException:
+                # a half-written entry would end replay there and take
+                # everything retried after it along; pending is kept, so
+                # the retry writes all of it again from here
+                os.ftruncate(file.fileno(), start)
+                raise
+        self.size += len(self.pending)
+        self.pending = []
+        return written
+
+    def replay(self):
+        self.size = 0
+        if not self.file.exists():
+            return
+        with open(self.file, "r+b") as file:
+            while True:
+                good = file.tell()
+                try:
+                    entry = pickle.load(file)
+                except (EOFError, pickle.UnpicklingError, ValueError, IndexError, TypeError):
+                    # clean end of file or a torn tail after a crash in the
+                    # middle of a write; either way drop everything past it
+                    file.truncate(good)
+                    break
+                self.size += 1
+                yield entry
+
+    def mark(self):
+        # where the entries appended from now on will start
+        return (self.file.stat().st_size if self.file.exists() else 0), self.size
+
+    def truncate(self, mark=None):
+        # without a mark everything goes; with one, the entries written
+        # after it are kept
+        position, size = mark or (0, self.size)
+        tail = b""
+        if mark is not None and self.file.exists():
+            with open(self.file, "rb") as file:
+                file.seek(position)
+                tail = file.read()
+        if tail:
+            tmp = self.file.with_name(self.file.name + ".tmp")
+            with open(tmp, "wb") as file:
+                file.write(tail)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp, self.file)
+        elif self.file.exists():
+            self.file.unlink()
+        self.size -= size
+
+
+class Autosaver(threading.Thread):
+    # write-behind saving: the first unsaved change starts a countdown of
+    # `delay` seconds, everything changed meanwhile goes into the same save
+    def __init__(self, save, changed, delay=5.0, on_error=None):
+        super().__init__(daemon=True)
+        self.save = save
+        self.changed = changed
+        self.delay = delay
+        self.on_error = on_error
+        self.now = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.changed.wait()
+            self.now.wait(self.delay)
+            self.now.clear()
+            if self.stopped.is_set():
+                break
+            self.changed.clear()
+            # any failure is retried with the next change and reported; an
+            # exception escaping here would end autosaving for the session
+            try:
+                self.save()
+            except Exception as e:
+                self.changed.set()
+                if self.on_error:
+                    self.on_error(e)
+
+    def save_now(self):
+        self.changed.set()
+        self.now.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.changed.set()
+        self.now.set()
+        self.join()
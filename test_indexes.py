@@ -0,0 +1,193 @@
+from datetime import date
+
+import pytest
+
+from indexes import BirthdayIndex, FullTextIndex, TagIndex
+from main import AddressBook, Note, NoteRecord, SqliteAddressBook
+
+
+def birthdays(**born):
+    index = BirthdayIndex()
+    for key, day in born.items():
+        index.set(key, day)
+    return index
+
+
+def test_leap_day_birthday_in_a_non_leap_year():
+    index = birthdays(leap=date(2000, 2, 29), feb28=date(1990, 2, 28), mar1=date(1985, 3, 1))
+    feb28 = date(2023, 2, 28)
+    # celebrated on Feb 28, together with the real Feb 28 birthdays
+    assert index.days_to("leap", feb28) == 0
+    assert index.upcoming(1, feb28) == [(0, "feb28"), (0, "leap"), (1, "mar1")]
+    mar1 = date(2023, 3, 1)
+    # just missed: the next one is Feb 29 of the leap year
+    assert index.days_to("leap", mar1) == (date(2024, 2, 29) - mar1).days
+    assert index.days_to("feb28", mar1) == (date(2024, 2, 28) - mar1).days
+    assert index.days_to("mar1", mar1) == 0
+
+
+def test_leap_day_birthday_in_a_leap_year():
+    index = birthdays(leap=date(2000, 2, 29), feb28=date(1990, 2, 28))
+    feb28 = date(2024, 2, 28)
+    assert index.days_to("leap", feb28) == 1
+    # on its own day, not on Feb 28 as well
+    assert index.upcoming(1, feb28) == [(0, "feb28"), (1, "leap")]
+    assert index.upcoming(0, date(2024, 2, 29)) == [(0, "leap")]
+
+
+def test_birthdays_across_the_new_year():
+    index = birthdays(eve=date(1990, 12, 31), jan2=date(1991, 1, 2), dec29=date(1992, 12, 29))
+    today = date(2023, 12, 30)
+    assert index.days_to("eve", today) == 1
+    assert index.days_to("jan2", today) == 3
+    # passed two days ago, so a whole (leap) year away
+    assert index.days_to("dec29", today) == 365
+    assert index.upcoming(5, today) == [(1, "eve"), (3, "jan2")]
+
+
+def test_birthday_index_follows_changes():
+    index = birthdays(ann=date(1990, 5, 1), bob=date(1990, 5, 1))
+    index.set("ann", date(1990, 6, 1))
+    index.remove("bob")
+    today = date(2023, 5, 1)
+    assert index.upcoming(0, today) == []
+    assert index.upcoming(31, today) == [(31, "ann")]
+    assert index.days_to("bob", today) == -1
+    # the window never goes past a year
+    assert index.upcoming(10_000, today) == [(31, "ann")]
+
+
+NOTES = {
+    "Ann": [("call the bank", "work urgent", "2024-01-05 09:00:00"),
+            ("buy a present", "home", "2024-02-10 18:30:00")],
+    "Bob": [("fix the roof", "home urgent", "2024-02-29 12:00:00"),
+            ("quarterly report", "#Work", "2024-03-01 08:00:00")],
+    "Cid": [("no tags at all", "", "2024-01-20 07:15:00"),
+            ("renew the passport", "docs urgent", "2023-12-31 23:59:59")],
+}
+
+
+def note_books(tmp_path):
+    # the same notes in both backends
+    books = [AddressBook(tmp_path / "book.pkl"), SqliteAddressBook(tmp_path / "book.db")]
+    for book in books:
+        book.load()
+        for name, notes in NOTES.items():
+            record = NoteRecord(name)
+            book.add_record(record)
+            for text, tags, date in notes:
+                record.add_note(text, tags, date)
+    return books
+
+
+def tagged(book, query, start=None, end=None, page=1, page_size=20):
+    total, notes = book.find_notes(query, start, end, page, page_size)
+    return total, [(name, note.value) for name, note in notes]
+
+
+def test_tag_query_grammar():
+    index = TagIndex()
+    assert index.parse_query("a b OR c -d") == [(["a", "b"], []), (["c"], ["d"])]
+    assert index.parse_query("#A AND NOT b") == [(["a"], ["b"])]
+    assert index.parse_query("OR") == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("urgent", ["renew the passport", "call the bank", "fix the roof"]),
+    ("urgent home", ["fix the roof"]),
+    ("urgent AND home", ["fix the roof"]),
+    ("work OR docs", ["renew the passport", "call the bank", "quarterly report"]),
+    ("urgent -home", ["renew the passport", "call the bank"]),
+    ("urgent NOT home", ["renew the passport", "call the bank"]),
+    ("-urgent", ["no tags at all", "buy a present", "quarterly report"]),
+    ("#WORK", ["call the bank", "quarterly report"]),
+    ("missing", []),
+])
+def test_tag_queries_agree_on_both_backends(tmp_path, query, expected):
+    for book in note_books(tmp_path):
+        total, notes = tagged(book, query)
+        assert [text for _, text in notes] == expected, type(book).__name__
+        assert total == len(expected)
+
+
+def test_tag_dates_and_pages_agree_on_both_backends(tmp_path):
+    for book in note_books(tmp_path):
+        # --to is a prefix: "2024-02" takes in the whole of February
+        assert tagged(book, "", "2024-01-10", "2024-02") == (
+            3, [("Cid", "no tags at all"), ("Ann", "buy a present"), ("Bob", "fix the roof")])
+        assert tagged(book, "urgent", end="2024-01-05") == (
+            2, [("Cid", "renew the passport"), ("Ann", "call the bank")])
+        assert tagged(book, "", page=2, page_size=4) == (
+            6, [("Bob", "fix the roof"), ("Bob", "quarterly report")])
+        assert tagged(book, "", page=3, page_size=4) == (6, [])
+
+
+def notes(*texts):
+    return [Note(text, f"2024-01-{day:02d} 10:00:00") for day, text in enumerate(texts, 1)]
+
+
+def fulltext(**texts):
+    index = FullTextIndex()
+    for key, value in texts.items():
+        index.set_notes(key, notes(*value))
+    return index
+
+
+def found(index, query):
+    total, hits = index.search(query, 0, 10)
+    assert total == len(hits)
+    return [(key, i) for key, i, _ in hits]
+
+
+def test_fulltext_phrase_and_prefix():
+    index = fulltext(ann=["the red car is fast", "a car that is red"], bob=["passport and password"])
+    assert found(index, '"red car"') == [("ann", 0)]
+    assert found(index, '"car red"') == []
+    assert sorted(found(index, "red car")) == [("ann", 0), ("ann", 1)]
+    assert found(index, "pass*") == [("bob", 0)]
+    assert found(index, "pass") == []
+    assert found(index, '"red car" pass*') == []
+
+
+def test_fulltext_ranks_by_bm25():
+    index = fulltext(ann=["invoice for roof"], bob=["invoice invoice paid"], cid=["invoice for the roof and windows"],
+                     dan=["nothing to see"])
+    # more occurrences rank higher, and so does the shorter of two notes
+    assert found(index, "invoice") == [("bob", 0), ("ann", 0), ("cid", 0)]
+    total, hits = index.search("invoice", 1, 1)
+    assert total == 3 and [key for key, _, _ in hits] == ["ann"]
+
+
+def test_fulltext_follows_note_changes():
+    index = fulltext(ann=["alpha beta"], bob=["beta gamma", "delta"])
+    index.set_notes("bob", notes("gamma epsilon"))
+    # words no note uses any more leave the vocabulary, the rest stay sorted
+    assert index.vocabulary == sorted(index.postings) == ["alpha", "beta", "epsilon", "gamma"]
+    assert found(index, "delta") == []
+    assert found(index, "beta") == [("ann", 0)]
+    assert index.expand("e") == ["epsilon"]
+    index.set_notes("ann", ())
+    assert index.vocabulary == ["epsilon", "gamma"]
+    assert index.total_length == 2 and set(index.lengths) == {("bob", 0)}
+
+
+def test_fulltext_survives_compaction_and_reload(tmp_path):
+    book = AddressBook(tmp_path / "book.pkl")
+    book.load()
+    for name, texts in {"Ann": ["call the bank about the loan"], "Bob": ["bank holiday trip", "fix the roof"]}.items():
+        record = NoteRecord(name)
+        book.add_record(record)
+        for text in texts:
+            record.add_note(text, "", "2024-01-01 10:00:00")
+    book.compact()
+    # after the compaction, in the journal only
+    book["Bob"].remove_note("bank holiday trip")
+    book.dump()
+    again = AddressBook(tmp_path / "book.pkl")
+    again.load()
+    search = lambda book, query: [(name, note.value) for name, note, _ in book.search_notes(query)[1]]
+    for one in (book, again):
+        assert search(one, "bank") == [("Ann", "call the bank about the loan")]
+        assert search(one, "holiday") == []
+        assert search(one, '"the roof"') == [("Bob", "fix the roof")]
+    assert "holiday" not in again.fulltext.vocabulary
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import sys
+
+from main import AddressBook, Controller
+from server import BookServer
+
+
+def serve(tmp_path, monkeypatch, talk):
+    # the server swaps sys.stdout for its capturing wrapper
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+
+    async def main():
+        controller = Controller(AddressBook(tmp_path / "book.pkl"))
+        controller.do_load()
+        server = BookServer(controller, workers=4)
+        listener = await server.start(port=0)
+        port = listener.sockets[0].getsockname()[1]
+        try:
+            return await talk(port), controller.book
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            server.pool.shutdown()
+
+    return asyncio.run(main())
+
+
+async def connect(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+
+    async def send(line):
+        writer.write(line.encode() + b"\n")
+        await writer.drain()
+        return json.loads(await reader.readline())
+
+    async def call(command, answers=()):
+        return await send(json.dumps({"command": command, "input": list(answers)}))
+
+    return send, call, writer
+
+
+def test_concurrent_clients(tmp_path, monkeypatch):
+    async def client(port, number):
+        _, call, writer = await connect(port)
+        name = f"Client{'abcdefgh'[number]}"
+        assert (await call("add_name", [name]))["ok"]
+        for i in range(5):
+            added = await call(f"add_phone {name} 050{number}00000{i}")
+            assert added["ok"] and "додано" in added["output"]
+            found = await call(f"find_info {name}")
+            assert found["ok"] and name in found["output"]
+        writer.close()
+
+    async def talk(port):
+        await asyncio.gather(*(client(port, number) for number in range(8)))
+
+    _, book = serve(tmp_path, monkeypatch, talk)
+    assert len(book) == 8
+    for number in range(8):
+        record = book[f"Client{'abcdefgh'[number]}"]
+        assert sorted(phone.value for phone in record.phones) == [f"050{number}00000{i}" for i in range(5)]
+
+
+def test_bad_requests_get_an_error(tmp_path, monkeypatch):
+    async def talk(port):
+        send, call, writer = await connect(port)
+        answers = [
+            await send("[1, 2]"),
+            await send('{"command": 5}'),
+            await send('{"command": "find_info Ann'),
+            await send(json.dumps({"command": "add_name", "input": "Ann"})),
+            await send(json.dumps({"command": "add_name", "input": [1]})),
+            await call("import contacts.csv"),
+            await call("export contacts.csv"),
+            await call("sort_files /tmp"),
+            await call("stats --profile profile.out"),
+            await call("dedupe --out report.csv"),
+            await send(json.dumps({"command": "add_name", "input": ["Ann"], "id": 7})),
+        ]
+        writer.close()
+        return answers
+
+    answers, book = serve(tmp_path, monkeypatch, talk)
+    # the connection outlived all the bad ones
+    *bad, good = answers
+    assert [answer["ok"] for answer in bad] == [False] * len(bad)
+    assert good["ok"] and good["id"] == 7
+    assert list(book.data) == ["Ann"]
+    assert not (tmp_path / "profile.out").exists() and not (tmp_path / "report.csv").exists()
@@ -0,0 +1,165 @@
+import errno
+import io
+import pickle
+
+import pytest
+
+from main import AddressBook, NoteRecord, record_to_row
+import storage
+from storage import Journal
+
+
+def make_book(path, size=20):
+    book = AddressBook(path)
+    book.load()
+    for i in range(size):
+        record = NoteRecord(f"Contact {i}")
+        book.add_record(record)
+        record.add_phone(f"050{i:07d}")
+        record.add_note(f"note {i}", f"tag{i % 3}", "2024-01-01 10:00:00")
+    return book
+
+
+def rows(book):
+    return sorted((record_to_row(record) for record in book.data.values()), key=lambda row: row["name"])
+
+
+def reopen(path):
+    book = AddressBook(path)
+    book.load()
+    return book
+
+
+def test_journal_drops_torn_tail(tmp_path):
+    journal = Journal(tmp_path / "book.journal")
+    entries = [(seq, "add_note", "Ann", (f"note {seq}",)) for seq in range(3)]
+    for entry in entries:
+        journal.append(entry)
+    journal.flush()
+    # a crash in the middle of writing the next entry
+    torn = pickle.dumps((99, "add_note", "Ann", ("lost",)))
+    with open(journal.file, "ab") as file:
+        file.write(torn[:len(torn) // 2])
+    assert list(journal.replay()) == entries
+    # the torn bytes are gone, so what is appended next can be read back
+    journal.append((3, "delete", "Ann", ()))
+    journal.flush()
+    assert list(Journal(journal.file).replay()) == [*entries, (3, "delete", "Ann", ())]
+
+
+def test_journal_flush_failure_leaves_no_torn_entry(tmp_path, monkeypatch):
+    journal = Journal(tmp_path / "book.journal")
+    journal.append((0, "add_note", "Ann", ("n0",)))
+    journal.flush()
+    for seq in (1, 2):
+        journal.append((seq, "add_note", "Ann", (f"n{seq}",)))
+
+    class FullDisk(io.FileIO):
+        def write(self, data):
+            # half of it reaches the disk, then the disk is full
+            super().write(bytes(data[:len(data) // 2]))
+            raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(storage, "open", lambda file, mode, **kwargs: FullDisk(file, mode), raising=False)
+    with pytest.raises(OSError):
+        journal.flush()
+    monkeypatch.undo()
+    # the retry writes the pending entries after the last whole one
+    journal.flush()
+    assert [entry[3] for entry in Journal(journal.file).replay()] == [("n0",), ("n1",), ("n2",)]
+
+
+def test_journal_truncate_keeps_entries_after_mark(tmp_path):
+    # what compaction does: entries written while the snapshot was being
+    # written are not in it and have to stay
+    journal = Journal(tmp_path / "book.journal")
+    journal.append((1, "delete", "Ann", ()))
+    journal.flush()
+    mark = journal.mark()
+    journal.append((2, "delete", "Bob", ()))
+    journal.flush()
+    journal.truncate(mark)
+    assert journal.size == 1
+    assert list(Journal(journal.file).replay()) == [(2, "delete", "Bob", ())]
+
+
+def test_book_replays_journal_with_torn_tail(tmp_path):
+    book = make_book(tmp_path / "book.pkl", 5)
+    book.compact()
+    book["Contact 1"].add_phone("0670000001")
+    book.delete("Contact 2")
+    book.dump()
+    expected = rows(book)
+    with open(book.journal.file, "ab") as file:
+        file.write(b"\x80\x04\x95garbage")
+    assert rows(reopen(tmp_path / "book.pkl")) == expected
+
+
+def test_compact_reload_round_trip(tmp_path):
+    book = make_book(tmp_path / "book.pkl")
+    book.delete("Contact 3")
+    book["Contact 4"].add_email("four@example.com")
+    assert book.compact()
+    assert not book.journal.file.exists()
+    # changes after the compaction go to the journal on top of the new file
+    book["Contact 5"].add_phone("0670000005")
+    book.dump()
+    again = reopen(tmp_path / "book.pkl")
+    assert rows(again) == rows(book)
+    assert [record.name.value for record in again.find_by_phone("0670000005")] == ["Contact 5"]
+    assert [record.name.value for record in again.find_by_email("FOUR@example.com")] == ["Contact 4"]
+    total, notes = again.find_notes("tag1")
+    assert total == len(notes) == 7
+    assert "Contact 3" not in again
+
+
+def test_snapshot_is_isolated_across_compaction(tmp_path):
+    book = make_book(tmp_path / "book.pkl")
+    book.compact()
+    before = [record_to_row(record) for record in book.snapshot().values()]
+    with book.snapshot() as snapshot:
+        book["Contact 1"].add_phone("0670000001")
+        book["Contact 2"].clear_notes()
+        book.delete("Contact 3")
+        book.add_record(NoteRecord("Contact New"))
+        assert book.compact()
+        book["Contact 4"].add_note("after compaction", "late", "2024-02-01 10:00:00")
+        assert [record_to_row(record) for record in snapshot.values()] == before
+    book.dump()
+    after = rows(book)
+    assert rows(reopen(tmp_path / "book.pkl")) == after
+    names = [row["name"] for row in after]
+    assert "Contact 3" not in names and "Contact New" in names
+    assert "0670000001" in next(row["phones"] for row in after if row["name"] == "Contact 1")
+
+
+def test_import_spills_and_round_trips(tmp_path):
+    book = make_book(tmp_path / "book.pkl")
+    book.compact()
+    book.cache_size = 5
+    snapshot = book.snapshot()
+    before = [record_to_row(record) for record in snapshot.values()]
+    imported = [{"name": f"Imported {i}", "phones": [f"068{i:07d}"], "email": None, "address": None,
+                 "birthday": None, "notes": []} for i in range(30)]
+    # an existing contact is merged into, so the file record gets spilled too
+    imported.append({"name": "Contact 1", "phones": ["0670000001"], "email": None, "address": None,
+                     "birthday": None, "notes": []})
+    assert book.import_rows(iter(imported), chunk_size=7) == (30, 1, 0)
+    assert [record_to_row(record) for record in snapshot.values()] == before
+    assert rows(reopen(tmp_path / "book.pkl")) == rows(book)
+    assert [record.name.value for record in book.find_by_phone("0670000001")] == ["Contact 1"]
+    assert len(book.data) == 50
+
+
+def test_pages_skip_to_the_same_records(tmp_path):
+    book = make_book(tmp_path / "book.pkl", 23)
+    book.compact()
+    names = lambda pages: [[record.name.value for record in page] for page in pages]
+    everything = [record.name.value for record in book.snapshot().values()]
+    assert names(book.iterator(5, 3)) == [everything[15:20], everything[20:]]
+    # with a deleted and an added contact the skip can't jump by position
+    book.delete(everything[2])
+    book.add_record(NoteRecord("Contact New"))
+    everything = [record.name.value for record in book.snapshot().values()]
+    assert names(book.iterator(5, 4)) == [everything[20:]]
+    assert everything[-1] == "Contact New"